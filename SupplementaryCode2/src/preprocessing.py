@@ -1,21 +1,262 @@
-import subprocess, os, datetime, gzip
+import subprocess, os, datetime, gzip, time, hashlib, shutil, json, threading, fcntl
 import pandas as pd
 import numpy as np
 
+from itertools import islice, chain
+from multiprocessing import Pool
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import lru_cache
+from contextlib import contextmanager
 from tqdm import tqdm
 from Bio import SeqIO
+from scipy import stats
+
+_gzip_open = gzip.open # Preprocess.to_fasta/run_fused의 gzip 인자가 gzip module을 가리기 때문에 따로 참조
+
+_COMPLEMENT = str.maketrans('ACGTNRYKMSWBDHVacgtnrykmswbdhv', 'TGCANYRMKSWVHDBtgcanyrmkswvhdb')
+
+
+def _find_adapter_3p(seq:str, adapter:str, min_overlap:int=3) -> int:
+    '''cutadapt -a {adapter} -e 0 처럼 read에서 3' adapter가 시작하는 가장 왼쪽 위치를 찾는다. 없으면 -1.
+    Read 끝에 걸친 adapter의 앞부분 (min_overlap 이상)도 찾는다. Exact match만 지원한다.'''
+
+    len_seq = len(seq)
+    len_ad  = len(adapter)
+
+    pos = seq.find(adapter)
+    if pos >= 0: return pos
+
+    for overlap in range(min(len_ad - 1, len_seq), min_overlap - 1, -1):
+        if seq.endswith(adapter[:overlap]): return len_seq - overlap
+
+    return -1
+
+
+@lru_cache(maxsize=None)
+def _tool_version(command:str) -> str:
+    '''Tool version 확인 (e.g. 'cutadapt --version'). Cache key에 포함시키기 위해 사용.'''
+
+    result = subprocess.run(command, shell=True, capture_output=True, text=True)
+
+    return (result.stdout + result.stderr).strip()
+
+
+class StepCache:
+    def __init__(self, cache_dir:str, max_size_gb:float=100):
+        '''Preprocess / MAGeCK step의 결과를 저장하는 content-addressed cache.
+
+        각 step은 input file 내용의 hash, tool parameter, tool version으로 key를 만들고,
+        결과 파일은 {cache_dir}/{key}/ 에 저장된다. 같은 key의 결과가 있으면 step을 실행하지 않고 복사해온다.
+        전체 용량이 max_size_gb를 넘으면 가장 오래 사용되지 않은 entry부터 지운다 (LRU).'''
+
+        self.cache_dir = cache_dir
+        self.max_size  = max_size_gb * 1024**3
+
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # 큰 raw data를 매번 다시 hashing 하지 않도록 (path, size, mtime) 별 hash를 기록
+        self.hash_index = f'{cache_dir}/file_hash.json'
+
+
+    @contextmanager
+    def _lock(self):
+        '''file_hash.json을 여러 thread / process가 같이 쓰기 때문에 lock file (flock)로 보호한다.'''
+
+        with open(f'{self.cache_dir}/file_hash.lock', 'w') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try    : yield
+            finally: fcntl.flock(f, fcntl.LOCK_UN)
+
+
+    def _load_hash_index(self) -> dict:
+        try:
+            with open(self.hash_index) as f: return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+
+    def _save_hash_index(self, dict_hash:dict) -> None:
+        temp = f'{self.hash_index}.tmp{os.getpid()}_{threading.get_ident()}'
+        with open(temp, 'w') as f: json.dump(dict_hash, f)
+        os.replace(temp, self.hash_index)
+
+
+    def _file_hash(self, path:str) -> str:
+
+        stat = os.stat(path)
+        file_id = f'{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}'
+
+        with self._lock():
+            dict_hash = self._load_hash_index()
+
+        if file_id in dict_hash: return dict_hash[file_id]
+
+        # Hashing은 lock 밖에서 하고, 기록할 때만 다시 읽어서 (read-modify-write) 저장한다
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024**2), b''): sha.update(block)
+
+        with self._lock():
+            dict_hash = self._load_hash_index()
+            dict_hash[file_id] = sha.hexdigest()
+            self._save_hash_index(dict_hash)
+
+        return sha.hexdigest()
+
+
+    def key(self, inputs:list, params:dict, tool_version:str) -> str:
+        '''Input file 내용, parameter, tool version으로 step의 cache key를 만든다.'''
+
+        list_hash = [self._file_hash(f) for f in inputs]
+        content   = json.dumps({'inputs': list_hash, 'params': params, 'tool': tool_version}, sort_keys=True)
+
+        return hashlib.sha256(content.encode()).hexdigest()
+
+
+    def fetch(self, key:str, outputs:list) -> bool:
+        '''Cache에 key가 있으면 결과를 outputs 경로로 복사하고 True를 return 한다.'''
+
+        entry = f'{self.cache_dir}/{key}'
+        if not os.path.isdir(entry): return False
+
+        for i, out in enumerate(outputs):
+            cached = f'{entry}/{i}'
+            if not os.path.exists(cached): return False
+
+            if os.path.isdir(cached): shutil.copytree(cached, out, dirs_exist_ok=True)
+            else                    : shutil.copyfile(cached, out)
+
+        os.utime(entry) # LRU: 마지막 사용 시간 갱신
+
+        return True
+
+
+    def store(self, key:str, outputs:list) -> None:
+        '''Step 결과를 cache에 저장하고, 용량을 넘으면 오래된 entry를 지운다.'''
+
+        entry = f'{self.cache_dir}/{key}'
+        temp  = f'{entry}.tmp{os.getpid()}_{threading.get_ident()}'
+
+        # 같은 key를 다른 sample이 먼저 저장했으면 (같은 input, 같은 step) 그대로 사용한다
+        if os.path.isdir(entry): return
+
+        os.makedirs(temp, exist_ok=True)
+
+        for i, out in enumerate(outputs):
+            cached = f'{temp}/{i}'
+
+            if os.path.isdir(out): shutil.copytree(out, cached)
+            else                 : shutil.copyfile(out, cached)
+
+        try:
+            os.rename(temp, entry)
+        except OSError:
+            # 저장하는 사이에 다른 thread / process가 같은 entry를 만든 경우
+            shutil.rmtree(temp, ignore_errors=True)
+            if not os.path.isdir(entry): raise
+
+        self.evict()
+
+
+    def evict(self) -> None:
+        '''전체 cache 용량이 max_size를 넘지 않도록 마지막 사용 시간이 오래된 entry부터 지운다.'''
+
+        list_entry = []
+
+        for name in os.listdir(self.cache_dir):
+            entry = f'{self.cache_dir}/{name}'
+            if not os.path.isdir(entry) or '.tmp' in name: continue
+
+            size = sum(os.path.getsize(f'{root}/{f}') for root, _, files in os.walk(entry) for f in files)
+            list_entry.append((os.path.getmtime(entry), size, entry))
+
+        total_size = sum(size for _, size, _ in list_entry)
+
+        for _, size, entry in sorted(list_entry):
+            if total_size <= self.max_size: break
+
+            shutil.rmtree(entry, ignore_errors=True)
+            total_size -= size
+
+        self._prune_hash_index()
+
+
+    def _prune_hash_index(self) -> None:
+        '''file_hash.json에서 더 이상 존재하지 않거나 (삭제된 temp file 등) 내용이 바뀐 file의 기록을 지운다.'''
+
+        with self._lock():
+            dict_hash = self._load_hash_index()
+            dict_keep = {}
+
+            for file_id, file_hash in dict_hash.items():
+                path, size, mtime = file_id.rsplit(':', 2)
+
+                if not os.path.isfile(path): continue
+
+                stat = os.stat(path)
+                if f'{stat.st_size}' == size and f'{stat.st_mtime_ns}' == mtime: dict_keep[file_id] = file_hash
+
+            if len(dict_keep) != len(dict_hash): self._save_hash_index(dict_keep)
+
 
 class Preprocess:
-    def __init__(self, data_path:str, data_format:str='fq.gz'):
-        '''Processing NGS raw data for analysis'''
+    def __init__(self, data_path:str, data_format:str='fq.gz', threads:int=1, cache:StepCache=None):
+        '''Processing NGS raw data for analysis
+        threads는 cutadapt -j / seqkit -j 에 전달되는 step 당 thread 수.
+        cache (StepCache)가 주어지면 input/parameter/tool version이 같은 trim, revcom, to_fasta step은 건너뛴다.'''
 
         self.raw_data  = data_path
         self.processed = data_path
         self.data_fmt  = data_format
+        self.threads   = threads
+        self.cache     = cache
 
         self.file_name = data_path.split('/')[-1].replace(f'.{data_format}', '')
         
         self.temp_file = []
+        self.log       = [] # step 별 exit code, stderr, wall time
+
+
+    def _run_command(self, step:str, command:str, output:str) -> None:
+        '''Command를 실행하고 exit code, stderr, wall time을 self.log에 기록한다.
+        Exit code가 0이 아니면 CalledProcessError를 발생시켜 빈 파일이 다음 step으로 넘어가지 않게 한다.'''
+
+        start  = time.time()
+        result = subprocess.run(command, shell=True, capture_output=True, text=True)
+
+        self._add_log(step, result.returncode, result.stderr, time.time() - start, output)
+
+        if result.returncode != 0:
+            raise subprocess.CalledProcessError(result.returncode, command, result.stdout, result.stderr)
+
+
+    def _run_cached(self, step:str, command:str, output:str, params:dict, version_command:str) -> None:
+        '''Cache가 있으면 같은 key의 결과를 가져오고, 없으면 command를 실행한 뒤 결과를 cache에 저장한다.'''
+
+        if self.cache == None:
+            self._run_command(step, command, output)
+            return
+
+        start = time.time()
+        key   = self.cache.key([self.processed], dict(params, step=step), _tool_version(version_command))
+
+        if self.cache.fetch(key, [output]):
+            self._add_log(step, 0, 'cached', time.time() - start, output)
+            return
+        
+        self._run_command(step, command, output)
+        self.cache.store(key, [output])
+
+
+    def _add_log(self, step:str, returncode:int, stderr:str, wall_time:float, output:str=None) -> None:
+        self.log.append({
+            'sample'    : self.file_name,
+            'step'      : step,
+            'returncode': returncode,
+            'stderr'    : stderr,
+            'time'      : wall_time,
+            'output'    : output,
+        })
 
 
     def _check_requirements(self,) -> None:
@@ -32,8 +273,8 @@ class Preprocess:
 
         trimmed = self.processed.replace(f'.{self.data_fmt}', f'_trimmed.{self.data_fmt}')
 
-        command = f'cutadapt -a {finder} -o {trimmed} {self.processed} -e {error}'
-        subprocess.call(command, shell=True)
+        command = f'cutadapt -j {self.threads} -a {finder} -o {trimmed} {self.processed} -e {error}'
+        self._run_cached('trim', command, trimmed, {'finder': finder, 'error': error}, 'cutadapt --version')
 
         self.processed = trimmed
         self.temp_file.append(trimmed)
@@ -47,8 +288,8 @@ class Preprocess:
 
         revcom_file = self.processed.replace(f'.{self.data_fmt}', f'_revcom.{self.data_fmt}')
 
-        command = f'seqkit seq --seq-type DNA -r -p {self.processed} -o {revcom_file}'
-        subprocess.call(command, shell=True)
+        command = f'seqkit seq -j {self.threads} --seq-type DNA -r -p {self.processed} -o {revcom_file}'
+        self._run_cached('revcom', command, revcom_file, {}, 'seqkit version')
 
         self.processed = revcom_file
         self.temp_file.append(revcom_file)
@@ -65,8 +306,8 @@ class Preprocess:
         fq = self.processed
         fa = self.processed.replace(self.data_fmt, fa_fmt)
 
-        command = f'seqkit fq2fa {fq} -o {fa}'
-        subprocess.call(command, shell=True)
+        command = f'seqkit fq2fa -j {self.threads} {fq} -o {fa}'
+        self._run_cached('to_fasta', command, fa, {}, 'seqkit version')
 
         self.processed = fa
         self.temp_file.append(fa)
@@ -77,6 +318,59 @@ class Preprocess:
     
 
     
+    def run_fused(self, finder:str, error:float=0, gzip:bool=True, save_path:str=None) -> str:
+        '''trim > revcom > to_fasta 과정을 cutadapt/seqkit 없이 한 번의 streaming으로 처리한다.
+        중간 파일 (_trimmed, _revcom) 없이 최종 pp_*.fa(.gz) 파일만 만들기 때문에 finalize는 필요 없다.
+
+        3' adapter trimming은 cutadapt -a {finder} -e 0과 같은 방식 (최소 overlap 3nt의 partial match 포함)으로 
+        adapter와 그 뒤를 잘라낸다. Exact matching만 지원한다: cutadapt는 -e > 0 에서 mismatch와 indel을 모두 허용하므로 
+        error > 0 이면 결과가 달라지지 않도록 ValueError를 발생시킨다 (이 경우 trim > revcom > to_fasta를 사용).'''
+
+        if error != 0:
+            raise ValueError('run_fused supports only exact adapter matching (error=0). Please use trim, revcom and to_fasta for error > 0.')
+
+        self._check_requirements()
+
+        start = time.time()
+
+        if gzip == True: fa_fmt = 'fa.gz'
+        else           : fa_fmt = 'fa'
+
+        final_file_name = f'pp_{self.file_name}.{fa_fmt}'
+        if save_path != None: final_file_name = f'{save_path}/{final_file_name}'
+
+        if self.processed.endswith('.gz'): handle_in = _gzip_open(self.processed, 'rt')
+        else                             : handle_in = open(self.processed, 'r')
+
+        if gzip == True: handle_out = _gzip_open(final_file_name, 'wt', compresslevel=6)
+        else           : handle_out = open(final_file_name, 'w')
+
+        with handle_in, handle_out:
+            list_out = []
+
+            for i, line in enumerate(handle_in):
+                if   i % 4 == 0: header = line[1:].rstrip()
+                elif i % 4 == 1:
+                    seq = line.rstrip()
+                    pos = _find_adapter_3p(seq, finder)
+                    if pos >= 0: seq = seq[:pos]
+
+                    list_out.append(f'>{header}\n{seq.translate(_COMPLEMENT)[::-1]}\n')
+
+                    if len(list_out) == 100000:
+                        handle_out.write(''.join(list_out))
+                        list_out = []
+
+            handle_out.write(''.join(list_out))
+
+        self.processed = final_file_name
+        self.data_fmt  = fa_fmt
+
+        self._add_log('run_fused', 0, '', time.time() - start, final_file_name)
+
+        return final_file_name
+
+
     def finalize(self, save_path:str=None) -> str:
         '''Clean-up temp files and rename final processed data file.'''
 
@@ -93,15 +387,583 @@ class Preprocess:
         else:
             command = f'mv {self.processed} {save_path}/{final_file_name}'
 
-        subprocess.call(command, shell=True)
-        
         file_path = command.split(' ')[-1]
 
+        self._run_command('finalize', command, file_path)
+
         return file_path
     
 
 
-def make_df_umi(list_barcode:list, data_path:str, len_umi:int) -> pd.DataFrame:
+def _run_preprocess(data_path:str, steps:list, data_format:str, threads:int, save_path:str, cache:StepCache=None) -> list:
+    '''Worker: sample 하나의 preprocessing chain을 실행한다. 실패한 step이 있으면 거기서 멈추고 log를 return 한다.'''
+
+    data_pp = Preprocess(data_path=data_path, data_format=data_format, threads=threads, cache=cache)
+
+    current_step = 'finalize'
+
+    try:
+        for step, kwargs in steps:
+            current_step = step
+
+            # run_fused는 finalize 없이 최종 파일을 바로 만들기 때문에 save_path를 넘겨준다
+            if step == 'run_fused' and 'save_path' not in kwargs: kwargs = dict(kwargs, save_path=save_path)
+
+            getattr(data_pp, step)(**kwargs)
+
+        if 'run_fused' not in [step for step, _ in steps]:
+            current_step = 'finalize'
+            data_pp.finalize(save_path=save_path)
+
+    except subprocess.CalledProcessError:
+        pass # _run_command에서 이미 log에 기록됨
+
+    except Exception as e:
+        data_pp._add_log(current_step, None, repr(e), 0)
+
+    return data_pp.log
+
+
+def preprocess_batch(list_data:list, steps:list, n_jobs:int=4, threads:int=1, data_format:str='fq.gz', save_path:str=None, cache:StepCache=None) -> pd.DataFrame:
+    """여러 sample의 Preprocess chain을 worker pool에서 동시에 실행하고, step 별 결과를 summary table로 return 한다.
+
+    Args:
+        list_data (list): List of NGS raw data paths.
+        steps (list): List of (method name, kwargs) of Preprocess, executed in order. 
+                      e.g. [('to_fasta', {'gzip': True}), ('trim', {'finder': 'AAAAAATTCTAG', 'error': 0}), ('revcom', {})]
+                      finalize is called automatically at the end (not needed for 'run_fused').
+        n_jobs (int, optional): Maximum number of samples processed concurrently. Defaults to 4.
+        threads (int, optional): Threads per tool call (cutadapt -j, seqkit -j). Defaults to 1.
+        data_format (str, optional): Format of raw data. Defaults to 'fq.gz'.
+        save_path (str, optional): Directory for final processed files. Defaults to None.
+        cache (StepCache, optional): Step cache shared by all samples. Defaults to None.
+
+    Returns:
+        pd.DataFrame: One row per executed step with sample, step, returncode, stderr, time and output columns. 
+                      Failed steps have non-zero (or None) returncode and the sample's chain stops there.
+    """    
+
+    # Step이 없으면 finalize가 raw data를 pp_* 파일로 옮기게 된다
+    if len(steps) == 0:
+        raise ValueError('No step found. Please check your input: steps')
+
+    for step, _ in steps:
+        if not hasattr(Preprocess, step) or step.startswith('_'):
+            raise ValueError(f'Not available step: {step}. Please check your input: steps')
+
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        list_future = [executor.submit(_run_preprocess, data, steps, data_format, threads, save_path, cache) for data in list_data]
+        list_log    = [log for future in list_future for log in future.result()]
+
+    df_summary = pd.DataFrame(list_log, columns=['sample', 'step', 'returncode', 'stderr', 'time', 'output'])
+    
+    list_failed = df_summary[df_summary['returncode'] != 0]['sample'].unique()
+    if len(list_failed) > 0: print('[Warning] Preprocessing failed:', ', '.join(list_failed))
+
+    return df_summary
+
+
+def _check_seq_format(data_path:str):
+    '''Input checker: Check and Determine data file format'''
+
+    if   data_path.endswith('.fq.gz')   : data_format = 'fastq'; isgzip = True
+    elif data_path.endswith('.fa.gz')   : data_format = 'fasta'; isgzip = True
+    elif data_path.endswith('.fastq.gz'): data_format = 'fastq'; isgzip = True
+    elif data_path.endswith('.fasta.gz'): data_format = 'fasta'; isgzip = True
+    
+    elif data_path.endswith('.fq')      : data_format = 'fastq'; isgzip = False
+    elif data_path.endswith('.fa')      : data_format = 'fasta'; isgzip = False
+    elif data_path.endswith('.fastq')   : data_format = 'fastq'; isgzip = False
+    elif data_path.endswith('.fasta')   : data_format = 'fasta'; isgzip = False
+
+    else: raise ValueError('Not supported data format. Please check your input: data_path')
+
+    return data_format, isgzip
+
+
+def _iter_seq_chunks(data_path:str, data_format:str, isgzip:bool, chunk_size:int=100000):
+    '''Lightweight FASTA/FASTQ parser. SeqIO record 대신 sequence string만 
+    chunk_size 개씩 list로 묶어서 yield 한다. FASTQ는 4줄 record를 가정한다.'''
+
+    if isgzip: handle = gzip.open(data_path, 'rt')
+    else     : handle = open(data_path, 'r')
+
+    with handle:
+        chunk = []
+
+        if data_format == 'fastq':
+            for i, line in enumerate(handle):
+                if i % 4 != 1: continue
+
+                chunk.append(line.rstrip())
+                if len(chunk) == chunk_size:
+                    yield chunk
+                    chunk = []
+
+        elif data_format == 'fasta':
+            list_line = None
+
+            for line in handle:
+                if line.startswith('>'):
+                    if list_line is not None: chunk.append(''.join(list_line))
+                    list_line = []
+
+                    if len(chunk) == chunk_size:
+                        yield chunk
+                        chunk = []
+                
+                elif list_line is not None: 
+                    list_line.append(line.strip())
+            
+            if list_line is not None: chunk.append(''.join(list_line))
+
+        if len(chunk) > 0: yield chunk
+
+
+def _make_bc_neighbor_index(list_barcode:list) -> dict:
+    '''Barcode correction용 neighbor index. 각 barcode의 모든 1-mismatch variant (A/C/G/T/N 치환)를 
+    parent barcode에 mapping 한다. 2개 이상의 barcode에서 만들어지는 variant는 ambiguous (None)로 표시하고,
+    library에 이미 있는 barcode와 같은 variant는 제외한다.'''
+
+    set_bc   = set(list_barcode)
+    dict_nbr = {}
+
+    for bc in set_bc:
+        for i in range(len(bc)):
+            for base in 'ACGTN':
+                if base == bc[i]: continue
+
+                variant = bc[:i] + base + bc[i+1:]
+                if variant in set_bc: continue
+
+                if variant in dict_nbr and dict_nbr[variant] != bc: dict_nbr[variant] = None
+                else: dict_nbr[variant] = bc
+
+    return dict_nbr
+
+
+def _count_bc_umi(list_seq:list, dict_bc:dict, len_bc:int, len_umi:int, dict_nbr:dict=None, dict_stat:dict=None) -> dict:
+    '''Read sequence list에서 barcode/UMI 조합을 세서 dict_bc에 누적한다.
+    dict_nbr가 주어지면 library에 없는 barcode를 1-mismatch neighbor index로 보정하고, 
+    rescued/ambiguous read 수를 dict_stat에 누적한다.'''
+
+    for _seq in list_seq:
+        _bc  = _seq[:len_bc]
+        _umi = _seq[-len_umi:]
+
+        if _bc not in dict_bc:
+            if dict_nbr is None or _bc not in dict_nbr: continue
+
+            _bc = dict_nbr[_bc]
+            if _bc is None: dict_stat['ambiguous'] += 1; continue
+            else          : dict_stat['rescued']   += 1
+        
+        if _umi in dict_bc[_bc]: dict_bc[_bc][_umi] += 1
+        else                   : dict_bc[_bc][_umi] = 1
+
+    return dict_bc
+
+
+def _find_shard_offsets(data_path:str, data_format:str, n_shards:int) -> list:
+    '''Uncompressed FASTA/FASTQ 파일을 byte 단위로 n_shards 개로 나누고, 
+    각 경계를 다음 record의 시작 위치로 맞춘 (start, end) list를 return 한다.'''
+
+    file_size = os.path.getsize(data_path)
+    list_offset = [0]
+
+    with open(data_path, 'rb') as handle:
+        for i in range(1, n_shards):
+            handle.seek(file_size * i // n_shards)
+            handle.readline() # 중간부터 읽은 line은 버림
+
+            while True:
+                pos  = handle.tell()
+                line = handle.readline()
+
+                if not line: pos = file_size; break
+
+                if data_format == 'fasta':
+                    if line.startswith(b'>'): break
+
+                elif data_format == 'fastq':
+                    # Quality line도 '@'로 시작할 수 있으므로, 2줄 뒤가 '+'인지 확인
+                    if line.startswith(b'@'):
+                        handle.readline()
+                        if handle.readline().startswith(b'+'): break
+                        handle.seek(pos); handle.readline()
+
+            list_offset.append(max(pos, list_offset[-1]))
+
+    list_offset.append(file_size)
+
+    return [(list_offset[i], list_offset[i+1]) for i in range(n_shards) if list_offset[i] < list_offset[i+1]]
+
+
+def _iter_shard_seqs(data_path:str, data_format:str, start:int, end:int):
+    '''Byte 범위 [start, end) 안에서 시작하는 record의 sequence를 yield 한다.'''
+
+    with open(data_path, 'rb') as handle:
+        handle.seek(start)
+        pos = start
+
+        if data_format == 'fastq':
+            while pos < end:
+                record = [handle.readline() for _ in range(4)]
+                if not record[0]: break
+
+                pos += sum(len(line) for line in record)
+                yield record[1].rstrip().decode()
+
+        elif data_format == 'fasta':
+            list_line = None
+
+            while True:
+                line = handle.readline()
+                if not line: break
+
+                if line.startswith(b'>'):
+                    if list_line is not None: yield b''.join(list_line).decode()
+                    if pos >= end: list_line = None; break
+                    list_line = []
+                
+                elif list_line is not None:
+                    list_line.append(line.strip())
+
+                pos += len(line)
+
+            if list_line is not None: yield b''.join(list_line).decode()
+
+
+_BASE_CODE = np.full(256, 4, dtype=np.uint8)
+for _i, _b in enumerate(b'ACGT'): _BASE_CODE[_b] = _i
+
+
+def _pack_seq(arr_seq:np.ndarray):
+    '''(n_reads, length) uint8 ASCII array를 2-bit encoding 한 uint64 key로 만든다.
+    A/C/G/T 이외의 base (N 등)가 포함된 read는 valid=False 로 표시된다.'''
+
+    arr_code = _BASE_CODE[arr_seq]
+    is_valid = (arr_code < 4).all(axis=1)
+
+    keys = np.zeros(len(arr_code), dtype=np.uint64)
+    for i in range(arr_code.shape[1]):
+        keys = (keys << np.uint64(2)) | (arr_code[:, i] & 3).astype(np.uint64)
+
+    return keys, is_valid
+
+
+def _unpack_seq(keys:np.ndarray, length:int) -> np.ndarray:
+    '''2-bit encoding 된 uint64 key를 다시 sequence string array로 만든다.'''
+
+    shift    = np.uint64(2) * np.arange(length - 1, -1, -1, dtype=np.uint64)
+    arr_code = ((keys[:, None] >> shift) & np.uint64(3)).astype(np.uint8)
+    arr_byte = np.frombuffer(b'ACGT', dtype=np.uint8)[arr_code]
+
+    return np.ascontiguousarray(arr_byte).view(f'S{length}').ravel().astype(str)
+
+
+def _reduce_keys(keys:np.ndarray, cnts:np.ndarray, first:np.ndarray):
+    '''Sort-and-reduce: 같은 key의 count는 더하고, 처음 나타난 위치는 최솟값으로 합친다.'''
+
+    if len(keys) == 0: return keys, cnts, first
+
+    order = np.argsort(keys, kind='stable')
+    keys, cnts, first = keys[order], cnts[order], first[order]
+
+    idx_start = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+
+    return keys[idx_start], np.add.reduceat(cnts, idx_start), np.minimum.reduceat(first, idx_start)
+
+
+def _make_umi_df(barcodes:np.ndarray, umis:np.ndarray, cnts:np.ndarray) -> pd.DataFrame:
+    '''make_df_umi output DataFrame. 기존 (barcode 별 DataFrame concat) 결과와 같은 dtype 
+    (Barcode/UMI: object, count: float64)으로 만든다.'''
+
+    return pd.DataFrame({
+        'Barcode': pd.Series(barcodes, dtype=object),
+        'UMI'    : pd.Series(umis, dtype=object),
+        'count'  : pd.Series(cnts, dtype=np.float64),
+    })
+
+
+class _PackedBarcodeCounter:
+    def __init__(self, list_barcode:list, len_bc:int, len_umi:int, correct_barcode:bool=False):
+        '''Barcode/UMI를 2-bit packed uint64 key로 세는 counter.
+
+        Key는 (barcode index << 2*len_umi) | UMI 형태이고, chunk 마다 NumPy로 sort-and-reduce 한 결과를 누적한다.
+        A/C/G/T 이외의 base가 있는 UMI와 len_umi 보다 짧은 read는 드물기 때문에 작은 dict에 따로 센다.
+        각 key가 처음 나타난 위치를 (shard 번호 << 32 | shard 내 read 번호)로 기록해서 
+        dict 기반 make_df_umi와 동일한 순서의 output을 만든다.
+        correct_barcode=True 이면 1-mismatch neighbor index도 packed key로 만들어서 searchsorted로 찾는다.'''
+
+        self.list_bc = list(dict.fromkeys(list_barcode))
+        self.len_bc  = len_bc
+        self.len_umi = len_umi
+
+        if len_bc > 32 or len_umi > 32:
+            raise ValueError('Please check your input: packed mode supports barcode/UMI up to 32nt')
+        
+        if np.log2(len(self.list_bc)) + 2 * len_umi > 64:
+            raise ValueError('Please check your input: barcode index and UMI do not fit in a 64-bit key')
+
+        arr_bc = np.frombuffer(''.join(self.list_bc).encode(), dtype=np.uint8).reshape(-1, len_bc)
+        lib_keys, is_valid = _pack_seq(arr_bc)
+
+        if not is_valid.all():
+            raise ValueError('Please check your input: packed mode supports only A/C/G/T barcodes')
+
+        self.lib_order = np.argsort(lib_keys)
+        self.lib_keys  = lib_keys[self.lib_order]
+        self.umi_shift = np.uint64(2 * len_umi)
+
+        # Barcode correction: N이 없는 neighbor는 packed key로, N이 있는 neighbor는 dict로 찾는다
+        self.dict_nbr = None
+
+        if correct_barcode:
+            dict_idx      = {bc: i for i, bc in enumerate(self.list_bc)}
+            self.dict_nbr = {nbr: (-1 if bc is None else dict_idx[bc]) for nbr, bc in _make_bc_neighbor_index(self.list_bc).items()}
+
+            list_nbr = [nbr for nbr in self.dict_nbr if 'N' not in nbr]
+            arr_nbr  = np.frombuffer(''.join(list_nbr).encode(), dtype=np.uint8).reshape(-1, len_bc)
+            nbr_keys = _pack_seq(arr_nbr)[0]
+            
+            order = np.argsort(nbr_keys)
+            self.nbr_keys   = nbr_keys[order]
+            self.nbr_parent = np.array([self.dict_nbr[nbr] for nbr in list_nbr], dtype=np.int64)[order]
+
+        self.keys  = np.zeros(0, dtype=np.uint64)
+        self.cnts  = np.zeros(0, dtype=np.int64)
+        self.first = np.zeros(0, dtype=np.int64)
+
+        self.pending   = []
+        self.dict_etc  = {}
+        self.dict_stat = {'rescued': 0, 'ambiguous': 0}
+
+
+    def _find_barcode(self, list_seq:list, dict_stat:dict) -> np.ndarray:
+        '''각 read의 barcode index를 찾는다. Library에 없으면 -1.'''
+
+        arr_bc = np.frombuffer(''.join([s[:self.len_bc] for s in list_seq]).encode(), dtype=np.uint8)
+        bc_keys, is_valid = _pack_seq(arr_bc.reshape(-1, self.len_bc))
+
+        pos    = np.searchsorted(self.lib_keys, bc_keys).clip(max=len(self.lib_keys) - 1)
+        is_hit = is_valid & (self.lib_keys[pos] == bc_keys)
+        bc_idx = np.where(is_hit, self.lib_order[pos], -1)
+
+        if self.dict_nbr is None: return bc_idx
+
+        # Barcode correction: parent index >= 0 이면 rescued, -1 이면 ambiguous
+        parent = np.full(len(bc_idx), -2, dtype=np.int64)
+
+        idx_miss = np.flatnonzero(~is_hit & is_valid)
+        pos      = np.searchsorted(self.nbr_keys, bc_keys[idx_miss]).clip(max=len(self.nbr_keys) - 1)
+        is_nbr   = self.nbr_keys[pos] == bc_keys[idx_miss]
+        parent[idx_miss[is_nbr]] = self.nbr_parent[pos[is_nbr]]
+
+        for i in np.flatnonzero(~is_valid):
+            parent[i] = self.dict_nbr.get(list_seq[i][:self.len_bc], -2)
+
+        dict_stat['rescued']   += int((parent >= 0).sum())
+        dict_stat['ambiguous'] += int((parent == -1).sum())
+
+        return np.where(parent >= 0, parent, bc_idx)
+
+
+    def count(self, list_seq:list, shard_no:int=0):
+        '''Read chunk 하나를 세서 (keys, counts, first, dict_etc, dict_stat) 형태로 return 한다.'''
+
+        arr_len = np.fromiter(map(len, list_seq), dtype=np.int64, count=len(list_seq))
+        idx_ok  = np.flatnonzero(arr_len >= self.len_bc)
+        list_ok = [list_seq[i] for i in idx_ok]
+
+        offset    = np.int64(shard_no) << np.int64(32)
+        dict_etc  = {}
+        dict_stat = {'rescued': 0, 'ambiguous': 0}
+
+        if len(list_ok) == 0:
+            return np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), dict_etc, dict_stat
+
+        bc_idx = self._find_barcode(list_ok, dict_stat)
+        is_hit = bc_idx >= 0
+
+        idx_hit = np.flatnonzero(is_hit & (arr_len[idx_ok] >= self.len_umi))
+        arr_umi = np.frombuffer(''.join([list_ok[i][-self.len_umi:] for i in idx_hit]).encode(), dtype=np.uint8)
+        umi_keys, is_valid = _pack_seq(arr_umi.reshape(-1, self.len_umi))
+
+        # N 등이 포함된 UMI, 짧은 read는 dict로 따로 센다
+        idx_etc = np.union1d(idx_hit[~is_valid], np.flatnonzero(is_hit & (arr_len[idx_ok] < self.len_umi)))
+        for i in idx_etc:
+            key = (int(bc_idx[i]), list_ok[i][-self.len_umi:])
+            if key in dict_etc: dict_etc[key][0] += 1
+            else              : dict_etc[key] = [1, offset + idx_ok[i]]
+
+        keys = (bc_idx[idx_hit[is_valid]].astype(np.uint64) << self.umi_shift) | umi_keys[is_valid]
+        keys, idx_first, cnts = np.unique(keys, return_index=True, return_counts=True)
+
+        first = offset + idx_ok[idx_hit[is_valid][idx_first]]
+
+        return keys, cnts.astype(np.int64), first.astype(np.int64), dict_etc, dict_stat
+
+
+    def add(self, result:tuple):
+        '''count()의 결과를 누적한다. Pending 결과가 누적된 key 수보다 많아지면 merge 한다.'''
+
+        keys, cnts, first, dict_etc, dict_stat = result
+
+        self.pending.append((keys, cnts, first))
+
+        for key in dict_stat: self.dict_stat[key] += dict_stat[key]
+
+        for key, (cnt, pos) in dict_etc.items():
+            if key in self.dict_etc: 
+                self.dict_etc[key][0] += cnt
+                self.dict_etc[key][1] = min(self.dict_etc[key][1], pos)
+            else: 
+                self.dict_etc[key] = [cnt, pos]
+
+        if sum(len(p[0]) for p in self.pending) >= len(self.keys): self._merge()
+
+
+    def _merge(self):
+        if len(self.pending) == 0: return
+
+        self.keys, self.cnts, self.first = _reduce_keys(
+            np.concatenate([self.keys]  + [p[0] for p in self.pending]),
+            np.concatenate([self.cnts]  + [p[1] for p in self.pending]),
+            np.concatenate([self.first] + [p[2] for p in self.pending]),
+        )
+
+        self.pending = []
+
+
+    def to_df(self) -> pd.DataFrame:
+        '''누적된 count를 한 번에 columnar DataFrame으로 만든다.'''
+
+        self._merge()
+
+        bc_idx = (self.keys >> self.umi_shift).astype(np.int64)
+        umis   = _unpack_seq(self.keys & ((np.uint64(1) << self.umi_shift) - np.uint64(1)), self.len_umi)
+        cnts   = self.cnts
+        first  = self.first
+
+        if len(self.dict_etc) > 0:
+            list_key = list(self.dict_etc)
+            bc_idx = np.concatenate([bc_idx, np.array([k[0] for k in list_key], dtype=np.int64)])
+            umis   = np.concatenate([umis.astype(object), np.array([k[1] for k in list_key], dtype=object)])
+            cnts   = np.concatenate([cnts,  np.array([self.dict_etc[k][0] for k in list_key], dtype=np.int64)])
+            first  = np.concatenate([first, np.array([self.dict_etc[k][1] for k in list_key], dtype=np.int64)])
+
+        order = np.lexsort((first, bc_idx))
+
+        return _make_umi_df(np.array(self.list_bc, dtype=object)[bc_idx[order]], umis[order], cnts[order])
+
+
+_shard_param = {}
+
+def _init_shard_worker(list_barcode:list, len_bc:int, len_umi:int, mode:str, correct_barcode:bool):
+    '''Worker process마다 barcode 정보와 neighbor index를 한 번만 만들기 위한 initializer'''
+
+    _shard_param['barcode'] = list_barcode
+    _shard_param['len_bc']  = len_bc
+    _shard_param['len_umi'] = len_umi
+    _shard_param['mode']    = mode
+
+    if mode == 'packed':
+        _shard_param['counter'] = _PackedBarcodeCounter(list_barcode, len_bc, len_umi, correct_barcode)
+    
+    elif correct_barcode:
+        _shard_param['dict_nbr'] = _make_bc_neighbor_index(list_barcode)
+
+
+def _count_shard(shard:tuple):
+    '''Worker: shard 하나 (byte range 또는 sequence chunk)의 barcode/UMI를 센다.
+    stream mode는 (read가 있는 barcode만 담은 dict, dict_stat), packed mode는 packed key array를 return 한다.'''
+
+    shard_no, data = shard
+
+    if isinstance(data, list): list_seq = data
+    else                     : list_seq = _iter_shard_seqs(*data)
+
+    if _shard_param['mode'] == 'packed':
+        return _shard_param['counter'].count(list(list_seq), shard_no)
+
+    dict_bc   = {bc: {} for bc in _shard_param['barcode']}
+    dict_stat = {'rescued': 0, 'ambiguous': 0}
+    _count_bc_umi(list_seq, dict_bc, _shard_param['len_bc'], _shard_param['len_umi'], _shard_param.get('dict_nbr'), dict_stat)
+
+    return {bc: dict_bc[bc] for bc in dict_bc if len(dict_bc[bc]) > 0}, dict_stat
+
+
+def _iter_parallel_shards(list_barcode:list, data_path:str, data_format:str, isgzip:bool, 
+                          len_bc:int, len_umi:int, mode:str, n_workers:int, chunk_size:int, correct_barcode:bool=False):
+    '''Record 단위로 나눈 shard를 worker process에서 세고, shard 순서대로 결과를 yield 한다.
+    Shard 순서대로 merge 하기 때문에 UMI 순서까지 single-core 결과와 동일하다.
+
+    - Uncompressed file: byte offset 기준 shard (worker가 각자 파일을 읽음)
+    - gzip file: random access가 불가능하므로 main process가 chunk_size 개씩 읽어서 worker로 전달'''
+
+    with Pool(n_workers, initializer=_init_shard_worker, initargs=(list_barcode, len_bc, len_umi, mode, correct_barcode)) as pool:
+        
+        if isgzip:
+            iter_chunk = enumerate(_iter_seq_chunks(data_path, data_format, isgzip, chunk_size))
+
+            with tqdm(desc = 'Barcode/UMI sorting', ncols = 70, ascii = ' =', unit = ' reads', leave = True) as pbar:
+                while True:
+                    # 한 번에 worker 수의 2배 chunk만 읽어서 memory 사용량을 제한
+                    list_chunk = list(islice(iter_chunk, n_workers * 2))
+                    if len(list_chunk) == 0: break
+
+                    for result in pool.imap(_count_shard, list_chunk): yield result
+                    pbar.update(sum(len(chunk) for _, chunk in list_chunk))
+
+        else:
+            list_shard = [(i, (data_path, data_format, start, end)) 
+                          for i, (start, end) in enumerate(_find_shard_offsets(data_path, data_format, n_workers * 4))]
+
+            for result in tqdm(pool.imap(_count_shard, list_shard),
+                               total = len(list_shard),
+                               desc = 'Barcode/UMI sorting',
+                               ncols = 70,
+                               ascii = ' =',
+                               leave = True
+                               ):
+                yield result
+
+
+def _merge_bc_umi(dict_bc:dict, dict_shard:dict) -> dict:
+    '''Shard 결과 dict를 dict_bc에 누적한다.'''
+
+    for bc in dict_shard:
+        dict_umi = dict_bc[bc]
+        for umi, cnt in dict_shard[bc].items():
+            dict_umi[umi] = dict_umi.get(umi, 0) + cnt
+
+    return dict_bc
+
+
+def _bc_umi_dict_to_df(dict_bc:dict) -> pd.DataFrame:
+    '''Barcode/UMI count dictionary를 output DataFrame으로 만든다.
+    Barcode 마다 DataFrame을 만들어서 concat 하지 않고, 전체 column을 한 번에 만든다.'''
+
+    list_bc = [bc for bc in dict_bc if len(dict_bc[bc]) > 0]
+    arr_len = np.array([len(dict_bc[bc]) for bc in list_bc], dtype=np.int64)
+    n_total = int(arr_len.sum())
+
+    barcodes = np.repeat(np.array(list_bc, dtype=object), arr_len)
+    umis     = np.fromiter(chain.from_iterable(dict_bc[bc].keys() for bc in list_bc), dtype=object, count=n_total)
+    cnts     = np.fromiter(chain.from_iterable(dict_bc[bc].values() for bc in list_bc), dtype=np.float64, count=n_total)
+
+    return _make_umi_df(barcodes, umis, cnts)
+
+
+def _report_bc_correction(df_out:pd.DataFrame, dict_stat:dict):
+    '''Barcode correction 결과 (rescued/ambiguous read 수)를 출력하고 df_out.attrs에 기록한다.'''
+
+    print(f"[Info] Barcode correction - rescued: {dict_stat['rescued']}, ambiguous: {dict_stat['ambiguous']}")
+    df_out.attrs['barcode_correction'] = dict(dict_stat)
+
+
+def make_df_umi(list_barcode:list, data_path:str, len_umi:int, mode:str='memory', chunk_size:int=100000, n_workers:int=1, correct_barcode:bool=False) -> pd.DataFrame:
     """NGS read file에서 barcode별로 umi를 구분하고, 읽힌 수를 정리한
     DataFrame을 만들어주는 함수
 
@@ -109,35 +971,41 @@ def make_df_umi(list_barcode:list, data_path:str, len_umi:int) -> pd.DataFrame:
         list_barcode (list): List containing barcodes. pd.Series also acceptable.
         data_path (str): The path of NGS data file. FASTQ or FASTA file can be used.
         len_umi (int): The length of UMI for counting.
+        mode (str, optional): 'memory' loads every read with Bio.SeqIO before counting. 
+                              'stream' reads the file in chunks with a lightweight parser and counts on the fly, 
+                              so memory is bounded by the number of distinct barcode/UMI pairs. 
+                              'packed' streams the file like 'stream', but encodes barcode and UMI into 2-bit packed 
+                              uint64 keys and counts each chunk with NumPy sort-and-reduce. Defaults to 'memory'.
+        chunk_size (int, optional): Number of reads per chunk in 'stream' and 'packed' mode. Defaults to 100000.
+        n_workers (int, optional): Number of worker processes for 'stream' and 'packed' mode. If n_workers > 1, 
+                                   the file is split into record-aligned shards (byte ranges for plain files, 
+                                   read chunks for gzip files) which are counted in parallel and merged in order.
+                                   The result is identical to n_workers=1. Defaults to 1.
+        correct_barcode (bool, optional): If True, reads whose barcode is 1 mismatch away from exactly one library barcode 
+                                          are rescued to that barcode using a precomputed neighbor index (O(1) lookup per read). 
+                                          Neighbors shared by two or more barcodes are ambiguous and discarded.
+                                          The numbers of rescued/ambiguous reads are printed and stored in 
+                                          df_out.attrs['barcode_correction']. Defaults to False.
 
     Raises:
         ValueError: NGS data format or path error. 
         ValueError: The lengths of barcode error. Barcode length should be identical.
         ValueError: No barcode error. Check your barcode list.
+        ValueError: Not available mode.
+        ValueError: n_workers > 1 is only available in 'stream' or 'packed' mode.
 
     Returns:
         _type_: pd.DataFrame
     """    
      
     # Input checker: Check and Determine data file format
-    def _check_input(data_path:str):
-        '''Input checker: Check and Determine data file format'''
+    data_format, isgzip = _check_seq_format(data_path)
 
-        if   data_path.endswith('.fq.gz')   : data_format = 'fastq'; isgzip = True
-        elif data_path.endswith('.fa.gz')   : data_format = 'fasta'; isgzip = True
-        elif data_path.endswith('.fastq.gz'): data_format = 'fastq'; isgzip = True
-        elif data_path.endswith('.fasta.gz'): data_format = 'fasta'; isgzip = True
-        
-        elif data_path.endswith('.fq')      : data_format = 'fastq'; isgzip = False
-        elif data_path.endswith('.fa')      : data_format = 'fasta'; isgzip = False
-        elif data_path.endswith('.fastq')   : data_format = 'fastq'; isgzip = False
-        elif data_path.endswith('.fasta')   : data_format = 'fasta'; isgzip = False
-
-        else: raise ValueError('Not supported data format. Please check your input: data_path')
-
-        return data_format, isgzip
+    if mode not in ['memory', 'stream', 'packed']:
+        raise ValueError('Not available mode. Please select memory, stream or packed')
     
-    data_format, isgzip = _check_input(data_path)
+    if n_workers > 1 and mode == 'memory':
+        raise ValueError('Please check your input: n_workers > 1 is only available in stream or packed mode')
 
     # Input checker: Check barcode length. The length of barcodes should be identical.
     list_bc_len = [len(bc) for bc in list_barcode]
@@ -146,71 +1014,213 @@ def make_df_umi(list_barcode:list, data_path:str, len_umi:int) -> pd.DataFrame:
     len_bc = list_bc_len[0]
     
 
+    # Packed mode: 2-bit packed key counting and single columnar output
+    if mode == 'packed':
+        counter = _PackedBarcodeCounter(list_barcode, len_bc, len_umi, correct_barcode)
+
+        if n_workers > 1:
+            for result in _iter_parallel_shards(counter.list_bc, data_path, data_format, isgzip, 
+                                                len_bc, len_umi, mode, n_workers, chunk_size, correct_barcode):
+                counter.add(result)
+        
+        else:
+            with tqdm(desc = 'Barcode/UMI sorting', ncols = 70, ascii = ' =', unit = ' reads', leave = True) as pbar:
+                for i, list_seq in enumerate(_iter_seq_chunks(data_path, data_format, isgzip, chunk_size)):
+                    counter.add(counter.count(list_seq, i))
+                    pbar.update(len(list_seq))
+
+        df_out = counter.to_df()
+
+        if correct_barcode: _report_bc_correction(df_out, counter.dict_stat)
+
+        return df_out
+
     # Step1: Make dictionary containing Barcodes and founded UMIs
     dict_bc = {}
     for bc in list_barcode: dict_bc[bc] = {}
 
-    if isgzip: 
-        with gzip.open(data_path, 'rt') as handle:
-            list_seq = [str(s.seq) for s in SeqIO.parse(handle, data_format)]
+    dict_nbr  = _make_bc_neighbor_index(list(dict_bc)) if correct_barcode else None
+    dict_stat = {'rescued': 0, 'ambiguous': 0}
+
+    if mode == 'stream' and n_workers > 1:
+        for dict_shard, dict_shard_stat in _iter_parallel_shards(list(dict_bc), data_path, data_format, isgzip, 
+                                                                 len_bc, len_umi, mode, n_workers, chunk_size, correct_barcode):
+            _merge_bc_umi(dict_bc, dict_shard)
+            for key in dict_stat: dict_stat[key] += dict_shard_stat[key]
+
+    elif mode == 'stream':
+        with tqdm(desc = 'Barcode/UMI sorting', ncols = 70, ascii = ' =', unit = ' reads', leave = True) as pbar:
+            for list_seq in _iter_seq_chunks(data_path, data_format, isgzip, chunk_size):
+                _count_bc_umi(list_seq, dict_bc, len_bc, len_umi, dict_nbr, dict_stat)
+                pbar.update(len(list_seq))
 
     else:
-        list_seq = [str(s.seq) for s in SeqIO.parse(data_path, data_format)]
-
-    for _seq in tqdm(list_seq,
-                total = len(list_seq),        ## 전체 진행수
-                desc = 'Barcode/UMI sorting', ## 진행률 앞쪽 출력 문장
-                ncols = 70,                   ## 진행률 출력 폭 조절
-                ascii = ' =',                 ## 바 모양, 첫 번째 문자는 공백이어야 작동
-                leave = True
-                ):
-        
-        _bc  = _seq[:len_bc]
-        _umi = _seq[-len_umi:]
-        
-        if _bc in dict_bc: 
-            if _umi in dict_bc[_bc]: dict_bc[_bc][_umi] += 1
-            else                   : dict_bc[_bc][_umi] = 1
-        
-        else: continue
+        if isgzip: 
+            with gzip.open(data_path, 'rt') as handle:
+                list_seq = [str(s.seq) for s in SeqIO.parse(handle, data_format)]
+
+        else:
+            list_seq = [str(s.seq) for s in SeqIO.parse(data_path, data_format)]
+
+        _count_bc_umi(tqdm(list_seq,
+                    total = len(list_seq),        ## 전체 진행수
+                    desc = 'Barcode/UMI sorting', ## 진행률 앞쪽 출력 문장
+                    ncols = 70,                   ## 진행률 출력 폭 조절
+                    ascii = ' =',                 ## 바 모양, 첫 번째 문자는 공백이어야 작동
+                    leave = True
+                    ), dict_bc, len_bc, len_umi, dict_nbr, dict_stat)
 
     # Step2: Make DataFrame as output
-    list_df_temp = []
+    df_out = _bc_umi_dict_to_df(dict_bc)
+
+    if correct_barcode: _report_bc_correction(df_out, dict_stat)
+
+    return df_out
+
+
+
+def _cluster_umi_directional(list_umi:list, list_cnt:list) -> list:
+    '''UMI-tools의 directional method와 같은 방식으로 UMI를 clustering 하고 (parent UMI, read 수 합) list를 return 한다.
+    UMI a -> b edge는 hamming distance가 1이고 count_a >= 2 * count_b - 1 일 때 생긴다.
+    모든 pair를 비교하는 대신, 각 UMI의 1-mismatch variant를 dict에서 찾는 neighbor index를 사용한다.
+    Count가 같은 UMI는 먼저 나온 UMI를 parent로 선택한다.'''
+
+    dict_idx = {umi: i for i, umi in enumerate(list_umi)}
+    adj_list = [[] for _ in list_umi]
+
+    for i, umi in enumerate(list_umi):
+        for pos in range(len(umi)):
+            for base in 'ACGTN':
+                if base == umi[pos]: continue
+
+                j = dict_idx.get(umi[:pos] + base + umi[pos+1:])
+                if j is not None and list_cnt[i] >= list_cnt[j] * 2 - 1: adj_list[i].append(j)
+
+    order    = sorted(range(len(list_umi)), key=lambda i: -list_cnt[i])
+    rank     = {i: r for r, i in enumerate(order)}
+    found    = set()
+    observed = set()
+    list_out = []
+
+    for node in order:
+        if node in found: continue
+
+        # Breadth-first search on directional edges
+        component = {node}
+        queue     = [node]
+        while queue:
+            for next_node in adj_list[queue.pop()]:
+                if next_node not in component:
+                    component.add(next_node)
+                    queue.append(next_node)
+
+        found.update(component)
+
+        group = [i for i in sorted(component, key=lambda i: rank[i]) if i not in observed]
+        observed.update(group)
+
+        list_out.append((list_umi[group[0]], sum(list_cnt[i] for i in group)))
+
+    return list_out
+
+
+def dedup_umi(df_umi:pd.DataFrame, method:str='directional', save_path:str=None) -> pd.DataFrame:
+    """make_df_umi의 barcode/UMI count table에서 barcode별로 UMI를 deduplication 하고, 
+    parent UMI의 첫 base (A/C/G/T) 별로 read 수를 합친 ATGC subgroup table을 만든다.
+    MAGeCKanalyzer.setup에 들어가는 *_UMI_dedup_ATGC_subgroup.csv 형식과 동일하다.
+
+    Args:
+        df_umi (pd.DataFrame): Output of make_df_umi (Barcode, UMI, count).
+        method (str, optional): 'exact' keeps every UMI as its own group. 
+                                'directional' collapses 1-mismatch UMIs with count_a >= 2 * count_b - 1 (UMI-tools directional). 
+                                Defaults to 'directional'.
+        save_path (str, optional): If given, the result is saved as csv (index=False). Defaults to None.
+
+    Raises:
+        ValueError: Not available method.
+
+    Returns:
+        pd.DataFrame: Barcode, UMI_dedup (startA/startC/startG/startT), count
+    """    
+
+    if method not in ['exact', 'directional']:
+        raise ValueError('Not available method. Please select exact or directional')
+
+    dict_start = {'A': 0, 'C': 1, 'G': 2, 'T': 3}
+    dict_bc    = {}
+
+    for bc, umi, cnt in zip(df_umi['Barcode'], df_umi['UMI'], df_umi['count']):
+        if bc not in dict_bc: dict_bc[bc] = ([], [])
+        dict_bc[bc][0].append(umi)
+        dict_bc[bc][1].append(int(cnt))
+
+    list_bc  = []
+    list_cnt = []
 
     for bc in tqdm(dict_bc,
-                total = len(dict_bc),  ## 전체 진행수
-                desc = 'Make output ', ## 진행률 앞쪽 출력 문장
-                ncols = 70,            ## 진행률 출력 폭 조절
-                ascii = ' =',          ## 바 모양, 첫 번째 문자는 공백이어야 작동
-                leave = True
-                ):
+                   total = len(dict_bc),
+                   desc = 'UMI deduplication',
+                   ncols = 70,
+                   ascii = ' =',
+                   leave = True
+                   ):
         
-        list_bc  = []
-        list_umi = []
-        list_cnt = []
-        
-        for umi in dict_bc[bc]:
-            list_bc.append(bc)
-            list_umi.append(umi)
-            list_cnt.append(dict_bc[bc][umi])
-            
-        df_temp = pd.DataFrame()
-        df_temp['Barcode'] = list_bc
-        df_temp['UMI']     = list_umi
-        df_temp['count']   = list_cnt
-        
-        list_df_temp.append(df_temp)
-        
-        
-    df_out = pd.concat(list_df_temp).reset_index(drop=True)
+        umis, cnts = dict_bc[bc]
+
+        if method == 'directional': list_group = _cluster_umi_directional(umis, cnts)
+        else                      : list_group = zip(umis, cnts)
+
+        list_start = [0, 0, 0, 0]
+
+        for umi, cnt in list_group:
+            if umi[0] in dict_start: list_start[dict_start[umi[0]]] += cnt
+
+        list_bc.append(bc)
+        list_cnt.append(list_start)
+
+    df_out = pd.DataFrame({
+        'Barcode'  : np.repeat(np.array(list_bc, dtype=object), 4),
+        'UMI_dedup': ['startA', 'startC', 'startG', 'startT'] * len(list_bc),
+        'count'    : np.array(list_cnt, dtype=np.int64).ravel(),
+    })
+
+    if save_path != None: df_out.to_csv(save_path, index=False)
 
     return df_out
 
 
 
+def _bh_fdr(pval:np.ndarray) -> np.ndarray:
+    '''Benjamini-Hochberg FDR'''
+
+    pval  = np.asarray(pval, dtype=np.float64)
+    order = np.argsort(pval)
+    n     = len(pval)
+
+    fdr = pval[order] * n / np.arange(1, n + 1)
+    fdr = np.minimum.accumulate(fdr[::-1])[::-1].clip(max=1)
+
+    out = np.empty(n)
+    out[order] = fdr
+
+    return out
+
+
+def _run_mageck_command(command:str) -> None:
+    '''mageck command를 실행하고, exit code가 0이 아니면 (mageck이 없는 경우 포함) stderr와 함께 CalledProcessError를 발생시킨다.'''
+
+    result = subprocess.run(command, shell=True, capture_output=True, text=True)
+
+    if result.returncode != 0:
+        raise subprocess.CalledProcessError(result.returncode, command, result.stdout, result.stderr)
+
+
 class MAGeCKanalyzer:
-    def __init__(self, ):
-        '''Check dependencies and initializing'''
+    def __init__(self, cache:StepCache=None):
+        '''Check dependencies and initializing
+        cache (StepCache)가 주어지면 input/parameter/MAGeCK version이 같은 mageck test는 건너뛴다.'''
+
+        self.cache = cache
 
         # Requirements
         # MAGeCK, data directory structures
@@ -225,7 +1235,57 @@ class MAGeCKanalyzer:
 
         return self.df_count
 
-    def mageck(self, input_file:str, name:str, control:str='control', test:str='test', save_path:str=None):
+    def build_count_matrix(self, lib_reference:str, samples:dict, var_type:str='AA_var', rpm:bool=True, save_path:str=None) -> pd.DataFrame:
+        """Library reference와 여러 sample의 deduplicated UMI table (e.g. 모든 replicate x TKI)을 
+        Barcode-UMI index 기준으로 한 번에 join 해서, 하나의 wide count matrix를 만든다.
+
+        Args:
+            lib_reference (str): Path of epegRNA library reference (Barcode, SNV_var, AA_var, ...).
+            samples (dict): {column name: path of *_UMI_dedup_ATGC_subgroup.csv}. e.g. {'DMSO_A': ..., 'Imatinib_A': ...}
+            var_type (str, optional): 'SNV_var' or 'AA_var' used as Gene column. Defaults to 'AA_var'.
+            rpm (bool, optional): If True, each sample column is normalized to reads per million. Defaults to True.
+            save_path (str, optional): If given, the count matrix is saved as a MAGeCK input file. Defaults to None.
+
+        Raises:
+            ValueError: Not available var_type.
+
+        Returns:
+            pd.DataFrame: Index Barcode-UMI, columns Gene and one column per sample. 
+                          Only Barcode-UMI present in every sample are kept (inner join), same as setup.
+        """
+
+        if var_type not in ['SNV_var', 'AA_var']:
+            raise ValueError('Not available var_type. Please select SNV_var or AA_var')
+
+        df_id = pd.read_csv(lib_reference).set_index('Barcode')[var_type]
+
+        list_count = []
+
+        for name, path in samples.items():
+            df_umi = pd.read_csv(path)
+            list_count.append(pd.Series(df_umi['count'].to_numpy(), 
+                                        index=df_umi['Barcode'] + '_' + df_umi['UMI_dedup'], name=name))
+
+        df_count = pd.concat(list_count, axis=1, join='inner')
+        df_count.index.name = 'Barcode-UMI'
+
+        if rpm == True:
+            df_count = df_count * 1000000 / df_count.sum(axis=0)
+
+        list_bc = df_count.index.str.rsplit('_', n=1).str[0]
+        df_count.insert(0, 'Gene', df_id.loc[list_bc].to_numpy())
+
+        if save_path != None: df_count.to_csv(save_path)
+
+        return df_count
+
+
+    def mageck(self, input_file:str, name:str, control:str='control', test:str='test', save_path:str=None, backend:str='mageck'):
+        '''MAGeCK test를 실행하고 gene summary DataFrame을 return 한다.
+        backend='rra' 이면 mageck subprocess 대신 in-process scoring (MAGeCKanalyzer.rra)을 사용한다.'''
+
+        if backend not in ['mageck', 'rra']:
+            raise ValueError('Not available backend. Please select mageck or rra')
 
         if save_path == None:
             save_dir = f'mageck_result_{name}'
@@ -234,15 +1294,87 @@ class MAGeCKanalyzer:
         
         os.makedirs(save_dir, exist_ok=True)
 
+        if backend == 'rra':
+            df_rra_result = self.rra(pd.read_csv(input_file, index_col=0), control=control, test=test)
+            df_rra_result.to_csv(f'{save_dir}/{name}_summary.csv')
+
+            return df_rra_result
+
         command = f'mageck test -k {input_file} -t {test} -c {control} -n {save_dir}/{name}'
 
-        subprocess.call(command, shell=True)
+        if self.cache == None:
+            _run_mageck_command(command)
+        
+        else:
+            key = self.cache.key([input_file], {'name': name, 'control': control, 'test': test}, _tool_version('mageck --version'))
+
+            if not self.cache.fetch(key, [save_dir]):
+                _run_mageck_command(command)
+                self.cache.store(key, [save_dir])
 
         df_mageck_result = self._mageck2df(name=name, save_dir=save_dir)
         df_mageck_result.to_csv(f'{save_dir}/{name}_summary.csv')
 
         return df_mageck_result
     
+    def mageck_batch(self, jobs:list, n_jobs:int=4, save_path:str=None, backend:str='mageck'):
+        """여러 MAGeCK job (replicate x drug)을 process pool에서 동시에 실행하고, 
+        모든 결과를 하나의 long-format DataFrame으로 합친다.
+
+        Args:
+            jobs (list): List of (input_file, name, control, test) tuples or dicts with those keys. 
+                         Extra dict keys (e.g. 'replicate', 'drug') are added as key columns to the result.
+            n_jobs (int, optional): Number of worker processes. Defaults to 4.
+            save_path (str, optional): Directory passed to mageck for every job. Defaults to None.
+            backend (str, optional): 'mageck' or 'rra'. Defaults to 'mageck'.
+
+        Returns:
+            pd.DataFrame: Long-format gene summary of all successful jobs (id, name, key columns, MAGeCK columns).
+            pd.DataFrame: Per-job log with status, runtime, mageck returncode/stderr and error message.
+        """
+
+        list_job = []
+
+        for job in jobs:
+            if isinstance(job, dict): list_job.append(dict(job))
+            else: list_job.append(dict(zip(['input_file', 'name', 'control', 'test'], job)))
+
+        # Job이 없으면 pool을 만들지 않고 빈 결과와 빈 log를 return
+        if len(list_job) == 0:
+            print('[Warning] No MAGeCK job found')
+            return pd.DataFrame(), pd.DataFrame(columns=['name', 'status', 'time', 'returncode', 'stderr', 'error'])
+
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            list_future = [executor.submit(_run_mageck_job, self, job, save_path, backend) for job in list_job]
+            list_result = [future.result() for future in list_future]
+
+        list_df  = []
+        list_log = []
+
+        for job, (df_result, runtime, error, returncode, stderr) in zip(list_job, list_result):
+            dict_key = {k: v for k, v in job.items() if k not in ['input_file', 'control', 'test']}
+
+            list_log.append(dict(dict_key, status='Done' if error == None else 'Failed', time=runtime, 
+                                 returncode=returncode, stderr=stderr, error=error))
+
+            if df_result is None: continue
+
+            df_result = df_result.reset_index()
+            for i, (k, v) in enumerate(dict_key.items()): df_result.insert(i + 1, k, v)
+
+            list_df.append(df_result)
+
+        df_log = pd.DataFrame(list_log)
+
+        list_failed = df_log[df_log['status'] == 'Failed']['name']
+        if len(list_failed) > 0: print('[Warning] MAGeCK failed:', ', '.join(list_failed))
+
+        if len(list_df) > 0: df_out = pd.concat(list_df).reset_index(drop=True)
+        else               : df_out = pd.DataFrame()
+
+        return df_out, df_log
+
+
     def _mageck2df(self, name:str, save_dir:str) -> pd.DataFrame:
         '''MAGeCK results 파일을 DataFrame으로 만들어서 return'''
 
@@ -257,6 +1389,155 @@ class MAGeCKanalyzer:
         return result
 
 
+    def rra(self, data:pd.DataFrame, control:str='control', test:str='test', alpha:float=0.25) -> pd.DataFrame:
+        """MAGeCK test의 subprocess/file I/O 없이, memory 위의 count matrix로 gene-level enrichment를 계산한다.
+        MAGeCK와 같은 흐름으로 계산하지만, gene p-value는 permutation 대신 RRA의 analytic 근사 (min(rho * n, 1))를 사용한다.
+
+        1. Median-ratio normalization (모든 sample에서 count > 0 인 guide가 없으면 total-count normalization)
+        2. Guide (Barcode-UMI) 별 mean-variance model: var = mean + k * mean^b 를 control에서 fitting 
+           (control이 1개이면 전체 sample로 variance를 추정)
+        3. Negative binomial 분포로 guide 별 p-value (neg: lower tail, pos: upper tail)와 rank percentile 계산
+        4. Gene 별로 percentile이 alpha 이하인 guide로 robust rank aggregation (rho = min_k Beta(u_k; k, n-k+1))
+
+        Args:
+            data (pd.DataFrame): Count matrix with 'Gene' column (output of setup or build_count_matrix).
+            control (str, optional): Control column(s). List or comma-separated string. Defaults to 'control'.
+            test (str, optional): Test column(s). List or comma-separated string. Defaults to 'test'.
+            alpha (float, optional): Percentile cutoff for guides used in RRA. Defaults to 0.25.
+
+        Returns:
+            pd.DataFrame: Gene summary with the same columns as MAGeCK gene_summary (neg|score, pos|score, ...) and 'p-value'.
+        """
+
+        list_ctrl = control.split(',') if isinstance(control, str) else list(control)
+        list_test = test.split(',')    if isinstance(test, str)    else list(test)
+
+        arr_cnt = data[list_ctrl + list_test].to_numpy(dtype=np.float64)
+        genes   = data['Gene'].to_numpy()
+
+        # Step1: Median-ratio normalization
+        is_pos = (arr_cnt > 0).all(axis=1)
+
+        if is_pos.sum() > 0:
+            log_cnt  = np.log(arr_cnt[is_pos])
+            size_fac = np.exp(np.median(log_cnt - log_cnt.mean(axis=1, keepdims=True), axis=0))
+
+        else:
+            # 모든 sample에서 count > 0 인 guide가 없으면 MAGeCK --norm-method total과 같이 total count로 normalization
+            total = arr_cnt.sum(axis=0)
+            if (total == 0).any():
+                raise ValueError('Some samples have no read count. Please check your input: control, test')
+
+            print('[Warning] No guide has positive counts in all samples. Total-count normalization is used.')
+            size_fac = total / total.mean()
+
+        arr_cnt = arr_cnt / size_fac
+
+        arr_ctrl = arr_cnt[:, :len(list_ctrl)]
+        arr_test = arr_cnt[:, len(list_ctrl):]
+
+        # Step2: Mean-variance model
+        mean = arr_ctrl.mean(axis=1) + 1
+
+        if len(list_ctrl) > 1: var_raw = arr_ctrl.var(axis=1, ddof=1)
+        else                 : var_raw = arr_cnt.var(axis=1, ddof=1)
+
+        is_fit = var_raw > mean
+        if is_fit.sum() >= 2:
+            b, log_k = np.polyfit(np.log(mean[is_fit]), np.log(var_raw[is_fit] - mean[is_fit]), 1)
+        else:
+            b, log_k = 1.0, 0.0
+
+        var = mean + np.exp(log_k) * mean ** b
+
+        # Step3: Guide level NB p-value and percentile
+        nb_n = mean ** 2 / (var - mean)
+        nb_p = mean / var
+        x    = np.round(arr_test.mean(axis=1))
+
+        pval_neg = stats.nbinom.cdf(x, nb_n, nb_p)
+        pval_pos = stats.nbinom.sf(x - 1, nb_n, nb_p)
+        guide_lfc = np.log2((arr_test.mean(axis=1) + 1) / mean)
+
+        gene_code, gene_id = pd.factorize(genes)
+
+        df_out = pd.DataFrame(index=pd.Index(gene_id, name='id'))
+        df_out['num'] = np.bincount(gene_code, minlength=len(gene_id))
+
+        for direction, pval in [('neg', pval_neg), ('pos', pval_pos)]:
+            percentile = stats.rankdata(pval) / len(pval)
+            score, n_good = self._rra_score(gene_code, percentile, alpha)
+            gene_pval = np.minimum(score * np.maximum(n_good, 1), 1)
+
+            df_out[f'{direction}|score']     = score
+            df_out[f'{direction}|p-value']   = gene_pval
+            df_out[f'{direction}|fdr']       = _bh_fdr(gene_pval)
+            df_out[f'{direction}|rank']      = stats.rankdata(score, method='min').astype(np.int64)
+            df_out[f'{direction}|goodsgrna'] = n_good
+            df_out[f'{direction}|lfc']       = pd.Series(guide_lfc).groupby(gene_code).median().to_numpy()
+
+        df_out['p-value'] = np.minimum(df_out['pos|score'], df_out['neg|score'])
+
+        return df_out.sort_values('neg|rank')
+
+
+    def _rra_score(self, gene_code:np.ndarray, percentile:np.ndarray, alpha:float):
+        '''Gene 별 RRA score (rho)와 alpha 이하 guide 수를 한 번에 계산한다.'''
+
+        order = np.lexsort((percentile, gene_code))
+        code  = gene_code[order]
+        u     = percentile[order]
+
+        idx_start = np.flatnonzero(np.r_[True, code[1:] != code[:-1]])
+        n_guide   = np.diff(np.r_[idx_start, len(code)])
+
+        is_good = u <= alpha
+        n_good  = np.add.reduceat(is_good.astype(np.int64), idx_start)
+
+        # Percentile이 정렬되어 있으므로, alpha 이하 guide는 gene 내에서 앞쪽 k번째 까지
+        k   = np.arange(len(code)) - np.repeat(idx_start, n_guide) + 1
+        n   = np.repeat(n_guide, n_guide)
+        rho = np.where(is_good, stats.beta.cdf(u, k, n - k + 1), 1.0)
+
+        return np.minimum.reduceat(rho, idx_start), n_good
+
+
+    def validate_rra(self, df_rra:pd.DataFrame, mageck_result, top_n:int=20) -> pd.DataFrame:
+        """In-process RRA 결과를 실제 MAGeCK 결과와 비교한다.
+
+        Args:
+            df_rra (pd.DataFrame): Output of rra.
+            mageck_result: Path of MAGeCK gene_summary.txt or DataFrame from _mageck2df.
+            top_n (int, optional): Number of top genes for overlap comparison. Defaults to 20.
+
+        Returns:
+            pd.DataFrame: Spearman correlation and top-N overlap of neg|score, pos|score and p-value.
+        """
+
+        if isinstance(mageck_result, str):
+            mageck_result = pd.read_csv(mageck_result, sep='\t').set_index('id')
+            mageck_result['p-value'] = np.minimum(mageck_result['pos|score'], mageck_result['neg|score'])
+
+        list_gene = df_rra.index.intersection(mageck_result.index)
+        list_out  = []
+
+        for col in ['neg|score', 'pos|score', 'p-value']:
+            rra_val    = df_rra[col].loc[list_gene]
+            mageck_val = mageck_result[col].loc[list_gene]
+
+            top_rra    = set(rra_val.nsmallest(top_n).index)
+            top_mageck = set(mageck_val.nsmallest(top_n).index)
+
+            list_out.append({
+                'column'     : col,
+                'n_gene'     : len(list_gene),
+                'spearman_r' : stats.spearmanr(rra_val, mageck_val)[0],
+                f'top{top_n}_overlap': len(top_rra & top_mageck) / top_n,
+            })
+
+        return pd.DataFrame(list_out).set_index('column')
+
+
     def _make_template(self, lib_reference:str, dmso_umi_path:str, var_type:str='AA_var') -> pd.DataFrame:
 
         if var_type not in ['SNV_var', 'AA_var']:
@@ -271,7 +1552,7 @@ class MAGeCKanalyzer:
         df_dmso.columns = ['Barcode', 'UMI_dedup', 'control']
 
         # SNV sum: DMSO control
-        list_gene = [df_id['Gene'].loc[bc] for bc in df_dmso['Barcode']]
+        list_gene = df_id['Gene'].loc[df_dmso['Barcode']].to_numpy()
         df_dmso.insert(0, 'Gene', list_gene)
 
         df_dmso['Barcode-UMI'] = df_dmso['Barcode'] + '_' + df_dmso['UMI_dedup']
@@ -309,6 +1590,24 @@ class MAGeCKanalyzer:
 
 
 
+def _run_mageck_job(analyzer:MAGeCKanalyzer, job:dict, save_path:str, backend:str):
+    '''Worker: MAGeCK job 하나를 실행하고 (result, runtime, error, returncode, stderr)를 return 한다.
+    mageck이 없거나 exit code가 0이 아니면 output을 읽기 전에 exit code와 stderr를 기록한다.'''
+
+    start = time.time()
+
+    try:
+        df_result = analyzer.mageck(job['input_file'], job['name'], job.get('control', 'control'), job.get('test', 'test'), 
+                                    save_path=save_path, backend=backend)
+        return df_result, time.time() - start, None, 0, ''
+
+    except subprocess.CalledProcessError as e:
+        return None, time.time() - start, f'mageck exited with code {e.returncode}', e.returncode, e.stderr
+
+    except Exception as e:
+        return None, time.time() - start, repr(e), None, ''
+
+
 def pp_log(func):
     def wrapper(*args, **kwargs):
         pass
@@ -1,18 +1,196 @@
-import sys, os
+import sys, os, re, warnings
 import pandas as pd
 import numpy as np
 from tqdm import tqdm
 from glob import glob
+from multiprocessing import Pool
 from scipy.stats import fisher_exact
 from scipy import stats
+from scipy import sparse
 from moepy import lowess
 
-def make_count_file(freq_table:str, var_ref:str) -> pd.DataFrame:
+def convert_freq_table(freq_table:str, save_path:str=None) -> str:
+    """CRISPResso frequency table (.txt)을 Parquet 파일로 변환한다. 
+    Aligned_Sequence/Reference_Sequence는 dictionary encoding (category), n_deleted 등 integer column은 작은 dtype으로 저장한다.
+    같은 이름의 .parquet 파일이 있으면 VarCalling의 reader들이 .txt 대신 자동으로 사용한다.
+
+    Args:
+        freq_table (str): Path to the frequency table file generated by CRISPResso.
+        save_path (str, optional): Path of Parquet file. Defaults to freq_table with .parquet extension.
+
+    Returns:
+        str: Path of Parquet file.
+    """    
+
+    if save_path == None: save_path = os.path.splitext(freq_table)[0] + '.parquet'
+
+    df = pd.read_csv(freq_table, sep='\t')
+
+    for col in ['Aligned_Sequence', 'Reference_Sequence']:
+        if col in df.columns: df[col] = df[col].astype('category')
+
+    for col in ['n_deleted', 'n_inserted', 'n_mutated', '#Reads']:
+        if col in df.columns: df[col] = pd.to_numeric(df[col], downcast='unsigned')
+
+    df.to_parquet(save_path, index=False)
+
+    return save_path
+
+
+def _freq_table_parquet(freq_table:str) -> str:
+    '''convert_freq_table로 만든 .parquet 파일이 있고 .txt 보다 최신이면 그 경로를, 아니면 None을 return 한다.'''
+
+    parquet = os.path.splitext(freq_table)[0] + '.parquet'
+
+    if os.path.isfile(parquet) and (not os.path.isfile(freq_table) or os.path.getmtime(parquet) >= os.path.getmtime(freq_table)):
+        return parquet
+
+    return None
+
+
+def _restore_dtypes(df:pd.DataFrame) -> pd.DataFrame:
+    '''Parquet에서 읽은 category/unsigned integer column을 .txt에서 읽은 것과 같은 dtype으로 되돌린다.'''
+
+    for col in df.columns:
+        if   isinstance(df[col].dtype, pd.CategoricalDtype): df[col] = np.asarray(df[col], dtype=object)
+        elif pd.api.types.is_unsigned_integer_dtype(df[col]): df[col] = df[col].astype(np.int64)
+
+    return df
+
+
+def _read_freq_table(freq_table:str, columns:list=None) -> pd.DataFrame:
+    """Frequency table을 읽는다. convert_freq_table로 만든 .parquet 파일이 있고 .txt 보다 최신이면
+    필요한 columns만 Parquet에서 읽고, 아니면 .txt를 읽는다. 어느 쪽이든 같은 dtype의 DataFrame을 return 한다."""
+
+    parquet = _freq_table_parquet(freq_table)
+
+    if parquet != None: return _restore_dtypes(pd.read_parquet(parquet, columns=columns))
+
+    return pd.read_csv(freq_table, sep='\t', usecols=columns)
+
+
+def _iter_freq_table(freq_table:str, columns:list=None, chunk_size:int=None):
+    """Frequency table을 chunk_size row씩 나눠서 yield 한다 (streaming mode). 
+    chunk_size가 None이면 table 전체를 한 번에 yield 한다. Peak memory는 table 크기가 아니라 chunk_size에 비례한다."""
+
+    if chunk_size == None:
+        yield _read_freq_table(freq_table, columns)
+        return
+
+    parquet = _freq_table_parquet(freq_table)
+
+    if parquet != None:
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(parquet).iter_batches(batch_size=chunk_size, columns=columns):
+            yield _restore_dtypes(batch.to_pandas())
+
+    else:
+        with pd.read_csv(freq_table, sep='\t', usecols=columns, chunksize=chunk_size) as reader:
+            for df in reader: yield df
+
+
+def _seq_key(list_seq) -> np.ndarray:
+    """Sequence를 64-bit fingerprint (uint64)로 변환한다. 같은 sequence는 한 번만 hashing 하고,
+    서로 다른 sequence가 같은 key를 가지면 (hash collision) ValueError를 낸다."""
+
+    codes, uniq = pd.factorize(np.asarray(list_seq, dtype=object))
+    uniq_key    = pd.util.hash_array(np.asarray(uniq, dtype=object), categorize=False)
+
+    if len(np.unique(uniq_key)) != len(uniq_key):
+        raise ValueError('Sequence key collision: different sequences have the same 64-bit key. Please check your input.')
+
+    return uniq_key[codes]
+
+
+class _SeqKeyIndex:
+    def __init__(self, list_seq):
+        """Reference sequence들의 64-bit key index. 
+        Read sequence를 lookup 하면 string 대신 integer key로 join 해서 reference의 위치를 return 한다.
+
+        Args:
+            list_seq (list-like): Reference sequences (e.g. RefSeq column). 중복된 sequence는 하나의 key로 묶인다.
+        """
+
+        seqs = np.asarray(list_seq, dtype=object)
+        keys = _seq_key(seqs)
+
+        self.uniq_key, first, self.codes = np.unique(keys, return_index=True, return_inverse=True)
+        self.uniq_seq = seqs[first]
+        self.n_key    = len(self.uniq_key)
+
+    def lookup(self, list_seq) -> np.ndarray:
+        """Sequence마다 matching 되는 unique key의 위치 (self.uniq_key 기준)를 return 한다. 없으면 -1.
+        Key가 같은데 sequence가 다르면 (hash collision) ValueError를 낸다."""
+
+        seqs = np.asarray(list_seq, dtype=object)
+        keys = _seq_key(seqs)
+
+        if self.n_key == 0: return np.full(len(keys), -1, dtype=np.int64)
+
+        pos = np.searchsorted(self.uniq_key, keys)
+        pos[pos == self.n_key] = 0
+
+        is_matched = self.uniq_key[pos] == keys
+        pos[~is_matched] = -1
+
+        if (self.uniq_seq[pos[is_matched]] != seqs[is_matched]).any():
+            raise ValueError('Sequence key collision: different sequences have the same 64-bit key. Please check your input.')
+
+        return pos
+
+    def aggregate(self, list_seq, weights) -> tuple:
+        """Sequence별 weights (e.g. #Reads)를 reference key 단위로 합친다.
+
+        Returns:
+            tuple: (reference 순서대로 합친 값, reference에 없는 sequence들의 합)
+        """
+
+        pos     = self.lookup(list_seq)
+        weights = np.asarray(weights, dtype=np.int64)
+
+        is_matched = pos >= 0
+        uniq_sum   = np.bincount(pos[is_matched], weights=weights[is_matched], minlength=self.n_key).astype(np.int64)
+
+        return uniq_sum[self.codes], int(weights[~is_matched].sum())
+
+
+def _count_variant_reads(df_freq:pd.DataFrame, list_refseq:pd.Series, ref_index:'_SeqKeyIndex'=None) -> np.ndarray:
+    """Frequency table의 #Reads를 RefSeq에 integer key (_SeqKeyIndex)로 join 해서, RefSeq 순서대로 read 수를 return 한다.
+    RefSeq에 없는 Aligned_Sequence의 read 수는 모두 'No_matched' RefSeq에 더한다.
+    ref_index를 주면 (같은 variant library의 여러 table을 셀 때) index를 다시 만들지 않는다.
+    df_freq는 DataFrame 또는 DataFrame chunk들의 iterator (_iter_freq_table)."""
+
+    if ref_index == None: ref_index = _SeqKeyIndex(list_refseq)
+
+    # Streaming mode: chunk 마다 RefSeq 단위로 합친 read 수만 누적한다
+    if isinstance(df_freq, pd.DataFrame): df_freq = [df_freq]
+
+    count, unmatched_cnt = np.zeros(len(list_refseq), dtype=np.int64), 0
+
+    for df in df_freq:
+        chunk_count, chunk_unmatched = ref_index.aggregate(df['Aligned_Sequence'], df['#Reads'])
+
+        count         += chunk_count
+        unmatched_cnt += chunk_unmatched
+
+    is_no_matched = (list_refseq == 'No_matched').to_numpy()
+
+    if unmatched_cnt > 0 and not is_no_matched.any():
+        raise KeyError('No_matched: Not found No_matched row in var_ref. Please check your input.')
+
+    count[is_no_matched] += unmatched_cnt
+
+    return count
+
+
+def make_count_file(freq_table:str, var_ref:str, chunk_size:int=None) -> pd.DataFrame:
     """Using CRISPResso2 to extract read counts for each variant from the alignment file of reads.
     
     Args:
         freq_table (str): Path to the frequency table file generated by CRISPResso.
         var_ref (str): Path to the reference file containing the sequence with the variants to be analyzed and information about those variants.
+        chunk_size (int, optional): Number of rows read at once (streaming mode) for tables larger than memory. Defaults to None (whole table).
 
     Returns:
         pd.DataFrame: _description_
@@ -20,37 +198,279 @@ def make_count_file(freq_table:str, var_ref:str) -> pd.DataFrame:
     
     # Step1: read CRISPResso aligned & reference file
     df_ref = pd.read_csv(var_ref)
-    df = pd.read_csv(freq_table, sep = '\t')
+    df = _iter_freq_table(freq_table, columns=['Aligned_Sequence', '#Reads'], chunk_size=chunk_size)
     
     sample_name = os.path.basename(freq_table).replace('.txt', '')
-    dict_out = {}
+    print(f'[Info] Read counting: {sample_name}')
+
+    # Step2: read count (group by Aligned_Sequence and join with RefSeq)
+    # Step3: make output
+    df_out = df_ref.copy()
+    df_out['count'] = _count_variant_reads(df, df_ref['RefSeq'])
+
+    total_cnt = df_out['count'].sum()
+    df_out['frequency'] = df_out['count'] / total_cnt
+
+    return df_out
+
+
+_count_param = {}
+
+def _init_count_worker(dict_ref:dict, chunk_size:int):
+    '''Worker process마다 exon별 variant library와 key index를 한 번만 받기 위한 initializer'''
+
+    _count_param['ref'] = dict_ref
+    _count_param['chunk_size'] = chunk_size
+
+
+def _count_table(job:tuple):
+    '''Worker: frequency table 하나를 읽어서 해당 exon의 RefSeq 순서대로 read count를 return 한다.'''
+
+    freq_table, exon = job
+    df_ref, ref_index = _count_param['ref'][exon]
+
+    df = _iter_freq_table(freq_table, columns=['Aligned_Sequence', '#Reads'], chunk_size=_count_param['chunk_size'])
+
+    return _count_variant_reads(df, df_ref['RefSeq'], ref_index)
+
+
+def _parse_exon(freq_table:str) -> str:
+    '''Sample 이름에서 exon 번호를 가져온다 (e.g. K562PE4K_HTS_Exon4_Rep1_DMSO.txt -> 4)'''
+
+    n_sample = os.path.basename(freq_table).replace('.txt', '')
+
+    if re.search(r'Exon(\d+)', n_sample) == None:
+        raise ValueError(f'Not found exon number in file name: {freq_table}. Please check your input or use exon option.')
+
+    return re.search(r'Exon(\d+)', n_sample).group(1)
+
+
+def make_count_batch(freq_tables:list, info_dir:str='variants_info', exon:dict=None, n_jobs:int=4, 
+                     output:str='file', save_path:str=None, chunk_size:int=None) -> pd.DataFrame:
+    """여러 frequency table을 exon 별로 묶어서 한 번에 read count 한다. 
+    ex{n}_info.csv와 RefSeq key index는 exon마다 한 번만 만들고, table은 worker process에서 병렬로 센다.
+    결과는 table 별로 make_count_file과 동일하다.
+
+    Args:
+        freq_tables (list): Paths to the frequency table files generated by CRISPResso.
+        info_dir (str, optional): Directory of ex{n}_info.csv files. Defaults to 'variants_info'.
+        exon (dict, optional): {freq_table: exon} to override exon number parsed from the file name. Defaults to None.
+        n_jobs (int, optional): Number of worker processes. Defaults to 4.
+        output (str, optional): 'file' for per-sample Count_{sample}.csv files, 'matrix' for a variants x samples count matrix. Defaults to 'file'.
+        save_path (str, optional): Directory for Count_*.csv files ('file') or path of the matrix csv file ('matrix'). Defaults to None.
+        chunk_size (int, optional): Number of rows read at once in each worker (streaming mode). Defaults to None (whole table).
+
+    Returns:
+        pd.DataFrame: 'file' - summary (sample, exon, total read count, output path), 
+                      'matrix' - variant info (Exon, RefSeq, Label, ...) and read count columns of each sample. 
+                      Samples of other exons are NaN.
+    """    
+
+    if output not in ['file', 'matrix']:
+        raise ValueError('Not available output. Please select "file" or "matrix".')
+    
+    if exon == None: exon = {}
+
+    # Step1: group frequency tables by exon
+    list_job = [(f, str(exon.get(f, None) or _parse_exon(f))) for f in freq_tables]
+    list_sample = [os.path.basename(f).replace('.txt', '') for f in freq_tables]
+
+    # 다른 directory의 같은 이름 file은 Count_{sample}.csv / matrix column이 겹치므로 미리 확인한다
+    list_dup = sorted(set(n for n in list_sample if list_sample.count(n) > 1))
+
+    if len(list_dup) > 0:
+        raise ValueError(f'Duplicated sample name: {", ".join(list_dup)}. Please check your input: freq_tables')
+
+    # Step2: read variant library and build key index once per exon
+    dict_ref = {}
+
+    for n in sorted(set(e for _, e in list_job), key=lambda e: (len(e), e)):
+        df_ref = pd.read_csv(f'{info_dir}/ex{n}_info.csv')
+        dict_ref[n] = (df_ref, _SeqKeyIndex(df_ref['RefSeq']))
+
+    print(f'[Info] Read counting: {len(list_job)} tables, exon {", ".join(dict_ref)}')
+
+    # Step3: read count in worker processes
+    with Pool(n_jobs, initializer=_init_count_worker, initargs=(dict_ref, chunk_size)) as pool:
+        list_count = list(tqdm(pool.imap(_count_table, list_job), total=len(list_job), 
+                               desc='Read counting', ncols=70, ascii=' ='))
+
+    # Step4: make output
+    if output == 'file':
+        if save_path != None: os.makedirs(save_path, exist_ok=True)
+
+        list_summary = []
+
+        for (f, n), n_sample, count in zip(list_job, list_sample, list_count):
+            df_out = dict_ref[n][0].copy()
+            df_out['count'] = count
+            df_out['frequency'] = df_out['count'] / df_out['count'].sum()
+
+            out_file = None
+
+            if save_path != None:
+                out_file = f'{save_path}/Count_{n_sample}.csv'
+                df_out.to_csv(out_file, index=False)
+
+            list_summary.append({'sample': n_sample, 'exon': n, 'total_count': int(count.sum()), 'output': out_file})
+
+        return pd.DataFrame(list_summary)
+
+    list_df = []
+
+    for n, (df_ref, _) in dict_ref.items():
+        df_exon = df_ref.copy()
+        df_exon.insert(0, 'Exon', n)
+
+        df_cnt = pd.DataFrame({n_sample: count for (_, e), n_sample, count in zip(list_job, list_sample, list_count) if e == n}, 
+                              index=df_exon.index)
+
+        list_df.append(pd.concat([df_exon, df_cnt], axis=1))
+
+    df_matrix = pd.concat(list_df).reset_index(drop=True)
+    df_matrix = df_matrix[[col for col in df_matrix.columns if col not in list_sample] + list_sample]
 
-    for ref_seq in df_ref['RefSeq']:
-        dict_out[ref_seq]  = 0
+    if save_path != None: df_matrix.to_csv(save_path, index=False)
 
-    # Step2: read count
-    for i in tqdm(df.index, desc=f'[Info] Read counting: {sample_name}'):
-        data = df.iloc[i]
-        seq  = data['Aligned_Sequence']
-        cnt  = int(data['#Reads'])
+    return df_matrix
+
+
+def fisher_exact_batch(table:np.ndarray, block_size:int=2**22) -> tuple:
+    """여러 2x2 table의 two-sided Fisher exact test를 한 번에 계산한다. 
+    Mode 주변의 필요한 support 구간에서만 인접 항의 pmf 비율 (recurrence)로 관측값 대비 pmf를 계산해서
+    mode 반대편에서 pmf가 관측값의 (1 + 1e-7)배 이하가 되는 위치를 찾고, scipy.stats.fisher_exact와 같이 
+    양쪽 tail을 hypergeom cdf/sf로 더한다. Log-factorial table을 만들지 않기 때문에 memory/time이 
+    read 수 (sequencing depth)에 비례하지 않는다. scipy.stats.fisher_exact와의 비교는 validate_fisher_exact_batch로 한다.
+
+    Args:
+        table (np.ndarray): Array of 2x2 tables, shape (n, 2, 2). Same layout as scipy.stats.fisher_exact.
+        block_size (int, optional): Maximum number of pmf values computed at once (memory limit). Defaults to 2**22.
+
+    Raises:
+        ValueError: Occurs when the table has negative values.
+
+    Returns:
+        tuple: (odds ratio array, p-value array)
+    """
+
+    c = np.asarray(table, dtype=np.int64).reshape(-1, 2, 2)
+
+    if (c < 0).any():
+        raise ValueError('All values in table must be nonnegative. Please check your input.')
+
+    a, b, cc, d = c[:, 0, 0], c[:, 0, 1], c[:, 1, 0], c[:, 1, 1]
+
+    n1 = a + b    # row 1
+    n2 = cc + d   # row 2
+    n  = a + cc   # column 1
+    N  = n1 + n2
+
+    # Sample odds ratio (scipy와 동일: b*c == 0 이면 inf)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        oddsratio = np.where((b > 0) & (cc > 0), a * d / (b * cc), np.inf)
+
+    pvalue  = np.ones(len(c))
+    is_zero = (n1 == 0) | (n2 == 0) | (n == 0) | (n == N)
+    oddsratio[is_zero] = np.nan
+
+    # Hypergeometric support: max(0, n-n2) <= x <= min(n, n1)
+    # Mode에서 50 SD 이상 떨어진 x의 pmf는 double precision에서 무시할 수 있으므로 (관측값은 항상 포함) 그 구간만 계산한다
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sd = np.sqrt(n.astype(np.float64) * n1 * n2 * (N - n) / (N.astype(np.float64) ** 2 * (N - 1)))
+
+    mode  = ((n + 1) * (n1 + 1) / (N + 2)).astype(np.int64) # scipy와 같은 mode
+    span  = np.nan_to_num(50 * sd + 100).astype(np.int64)
+    x_min = np.maximum(np.maximum(0, n - n2), np.minimum(a, mode - span))
+    width = np.minimum(np.minimum(n, n1), np.maximum(a, mode + span)) - x_min + 1
+
+    # Mode 반대편에서 tail이 시작되는 위치 (a < mode: 첫 x, a >= mode: 마지막 x)
+    bound  = np.where(a < mode, x_min + width, x_min - 1)
+    is_tie = np.zeros(len(c), dtype=bool)
+
+    # Support 길이가 비슷한 table끼리 묶어서 (block) padding을 줄인다
+    order = np.argsort(width, kind='stable')
+    order = order[~is_zero[order]]
+
+    start = 0
+
+    while start < len(order):
+        end = start + 1
         
-        try   : dict_out[seq] += cnt
-        except: dict_out['No_matched'] += cnt
+        while end < len(order) and (end - start + 1) * width[order[end]] <= block_size: end += 1
 
-    # Step3: make output
-    list_count = []
+        i = order[start:end]
+        w = width[i].max()
 
-    for ref_seq in df_ref['RefSeq']:
-        list_count.append(dict_out[ref_seq])
+        x = x_min[i, None] + np.arange(w)[None, :]
+        is_valid = x <= (x_min[i] + width[i] - 1)[:, None]
 
-    df_out = df_ref.copy()
-    df_out['count'] = list_count
+        # log pmf(x+1) - log pmf(x) = log((n1-x)(n-x) / ((x+1)(n2-n+x+1))) 를 누적해서 관측값 대비 log pmf 비율을 구한다
+        # (log-factorial 차이보다 정확하고, 필요한 구간만 계산한다)
+        xf = x.astype(np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            log_ratio = (np.log(n1[i, None] - xf) + np.log(n[i, None] - xf) 
+                         - np.log(xf + 1) - np.log(n2[i, None] - n[i, None] + xf + 1))
 
-    total_cnt = df_out['count'].sum()
-    df_out['frequency'] = [cnt/total_cnt for cnt in df_out['count']]
+        log_ratio = np.where(is_valid[:, 1:], log_ratio[:, :-1], 0)
+        log_rel   = np.concatenate([np.zeros((len(i), 1)), np.cumsum(log_ratio, axis=1)], axis=1)
+        log_rel  -= np.take_along_axis(log_rel, (a[i] - x_min[i])[:, None], axis=1)
 
-    return df_out
+        # 관측값의 pmf * (1 + 1e-7) 이하인 mode 반대편의 x
+        is_low   = (a[i] < mode[i])[:, None]
+        is_other = is_valid & (log_rel <= np.log1p(1e-7)) & np.where(is_low, x >= mode[i, None], x <= mode[i, None])
 
+        bound[i]  = np.where(is_low[:, 0], np.where(is_other, x, np.iinfo(np.int64).max).min(axis=1), 
+                             np.where(is_other, x, -1).max(axis=1))
+        bound[i]  = np.where(is_other.any(axis=1), bound[i], np.where(is_low[:, 0], x_min[i] + width[i], x_min[i] - 1))
+        is_tie[i] = np.abs(np.take_along_axis(log_rel, (mode[i] - x_min[i])[:, None], axis=1)[:, 0]) <= 1e-12
+
+        start = end
+
+    # scipy.stats.fisher_exact와 같이 양쪽 tail을 hypergeom cdf/sf로 더한다
+    k = np.where(~is_zero & ~is_tie)[0]
+    is_low = a[k] < mode[k]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p_low  = stats.hypergeom.cdf(a[k], N[k], n1[k], n[k]) + stats.hypergeom.sf(bound[k] - 1, N[k], n1[k], n[k])
+        p_high = stats.hypergeom.sf(a[k] - 1, N[k], n1[k], n[k]) + stats.hypergeom.cdf(bound[k], N[k], n1[k], n[k])
+
+    pvalue[k] = np.minimum(np.where(is_low, p_low, p_high), 1.0)
+
+    return oddsratio, pvalue
+
+
+def validate_fisher_exact_batch(table:np.ndarray, n_check:int=100, rtol:float=1e-9, seed:int=0) -> pd.DataFrame:
+    """fisher_exact_batch의 p-value를 무작위로 고른 n_check개 table에서 scipy.stats.fisher_exact와 비교한다.
+    Analysis 중에는 호출되지 않는 검증용 함수이다.
+
+    Args:
+        table (np.ndarray): Array of 2x2 tables, shape (n, 2, 2).
+        n_check (int, optional): Number of randomly selected tables. Defaults to 100.
+        rtol (float, optional): Relative tolerance of p-value. Defaults to 1e-9.
+        seed (int, optional): Random seed for table selection. Defaults to 0.
+
+    Returns:
+        pd.DataFrame: Compared tables (index, pvalue, pvalue_scipy, is_equal).
+    """
+
+    c = np.asarray(table, dtype=np.int64).reshape(-1, 2, 2)
+    _, pvalue = fisher_exact_batch(c)
+
+    idx = np.sort(np.random.default_rng(seed).choice(len(c), size=min(n_check, len(c)), replace=False))
+    p_scipy = np.array([fisher_exact(c[k])[1] for k in idx], dtype=np.float64)
+
+    df_check = pd.DataFrame({
+        'index'       : idx,
+        'pvalue'      : pvalue[idx],
+        'pvalue_scipy': p_scipy,
+        'is_equal'    : np.abs(pvalue[idx] - p_scipy) <= rtol * np.maximum(p_scipy, 1e-250),
+    })
+
+    n_diff = (~df_check['is_equal']).sum()
+    if n_diff > 0: print(f'[Warning] {n_diff} of {len(df_check)} p-values differ from scipy.stats.fisher_exact (rtol={rtol})')
+    else: print(f'[Info] All {len(df_check)} p-values match scipy.stats.fisher_exact (rtol={rtol})')
+
+    return df_check
 
 
 def read_statistics(var_control:str, background:str, hit_label:str='SynPE', adjustment:str='bonferroni') -> pd.DataFrame:
@@ -79,12 +499,9 @@ def read_statistics(var_control:str, background:str, hit_label:str='SynPE', adju
     UE_WT_read  = df_UE[df_UE['Label']=='WT_refseq']['count'].iloc[0]
     UE_SynPE_df = df_UE[df_UE['Label']==hit_label].reset_index(drop=True)
 
-    # Step1: Make unedit dictionary
-    UE_SynPE_dict = {}
-
-    for i in UE_SynPE_df.index:
-        UE_data = UE_SynPE_df.iloc[i]
-        UE_SynPE_dict[UE_data['RefSeq']] = int(UE_data['count'])
+    # Step1: Make unedit key index (RefSeq -> 64-bit key)
+    UE_SynPE_index = _SeqKeyIndex(UE_SynPE_df['RefSeq'])
+    UE_SynPE_count = UE_SynPE_df.groupby(UE_SynPE_index.codes)['count'].last().to_numpy(dtype=np.int64)
 
     # Step2: Add odds/p-value column to each Stat file.
 
@@ -96,76 +513,206 @@ def read_statistics(var_control:str, background:str, hit_label:str='SynPE', adju
     total_cnt_wtseq = df_test[df_test['Label']=='WT_refseq']['count'].iloc[0]
     total_cnt_edseq = df_synpe['count'].sum()
 
-    list_sample_WT  = [] # list_sample_wt_cnt
-    list_sample_RPM = []
-    list_UE_SynPE   = []
-    list_UE_WT_read = []
-    list_odds_ratio = []
-    list_pvalue     = []
+    UE_SynPE_pos = UE_SynPE_index.lookup(df_synpe['RefSeq'])
 
-    for i in df_synpe.index:
+    if (UE_SynPE_pos < 0).any():
+        raise KeyError('Not found in background: %s. Please check your input files.' % df_synpe['RefSeq'][UE_SynPE_pos < 0].iloc[0])
 
-        data = df_synpe.loc[i]
+    sample_SynPE_cnt = df_synpe['count'].to_numpy(dtype=np.int64)
+    sample_SynPE_rpm = sample_SynPE_cnt*1000000/total_cnt_edseq
+    unedit_SynPE_cnt = UE_SynPE_count[UE_SynPE_pos]
 
-        sample_SynPE_cnt = int(df_synpe.loc[i]['count'])
-        sample_SynPE_rpm = sample_SynPE_cnt*1000000/total_cnt_edseq
-        unedit_SynPE_cnt = UE_SynPE_dict[data['RefSeq']]
+    # Calculate odds ratio
+    odds = ((sample_SynPE_cnt+1)/(total_cnt_wtseq+1))/((unedit_SynPE_cnt+1)/(UE_WT_read+1))
 
-        # Calculate odds ratio
-        odds = ((sample_SynPE_cnt+1)/(total_cnt_wtseq+1))/((unedit_SynPE_cnt+1)/(UE_WT_read+1))
-        
-        # Calculate Fisher test p-value
-        fisher_df = pd.DataFrame({'intended_edit':[sample_SynPE_cnt, unedit_SynPE_cnt], 'WT':[total_cnt_wtseq, UE_WT_read]})
-        oddsr, p = fisher_exact(table = fisher_df.to_numpy(), alternative = 'two-sided')
-
-        # Store the calculated values in a list.
-        list_sample_WT.append(total_cnt_wtseq)
-        list_sample_RPM.append(sample_SynPE_rpm)
-        list_UE_SynPE.append(unedit_SynPE_cnt)
-        list_UE_WT_read.append(UE_WT_read)
-        list_odds_ratio.append(odds)
-        list_pvalue.append(p)
-
-    df_synpe['Edited_WT_count'] = list_sample_WT
-    df_synpe['RPM']             = list_sample_RPM
-    df_synpe['UE_SynPE_count']  = list_UE_SynPE
-    df_synpe['UE_WT_count']     = list_UE_WT_read
-    df_synpe['OR']              = list_odds_ratio
+    # Calculate Fisher test p-value (all SynPE variants at once)
+    fisher_table = np.zeros((len(df_synpe), 2, 2), dtype=np.int64)
+    fisher_table[:, 0, 0] = sample_SynPE_cnt
+    fisher_table[:, 0, 1] = total_cnt_wtseq
+    fisher_table[:, 1, 0] = unedit_SynPE_cnt
+    fisher_table[:, 1, 1] = UE_WT_read
+
+    oddsr, list_pvalue = fisher_exact_batch(fisher_table)
+
+    df_synpe['Edited_WT_count'] = total_cnt_wtseq
+    df_synpe['RPM']             = sample_SynPE_rpm
+    df_synpe['UE_SynPE_count']  = unedit_SynPE_cnt
+    df_synpe['UE_WT_count']     = UE_WT_read
+    df_synpe['OR']              = odds
     df_synpe['pvalue']          = list_pvalue
 
     if adjustment == 'bonferroni':
-        df_synpe['adj_pvalue'] = [len(df_synpe)*pv for pv in list_pvalue]
+        df_synpe['adj_pvalue'] = len(df_synpe) * list_pvalue
 
     return df_synpe
 
 
+def _bh_adjust(pval:np.ndarray) -> np.ndarray:
+    '''Benjamini-Hochberg FDR adjusted p-value'''
+
+    pval  = np.asarray(pval, dtype=np.float64)
+    n     = len(pval)
+    order = np.argsort(pval)[::-1]
+
+    adj = np.minimum.accumulate(pval[order] * n / np.arange(n, 0, -1))
+    out = np.empty(n)
+    out[order] = np.minimum(adj, 1.0)
+
+    return out
+
+
+def read_statistics_matrix(samples, background:str, hit_label:str='SynPE', adjustment:str='bonferroni', 
+                           output:str='long', save_path:str=None) -> pd.DataFrame:
+    """여러 sample을 하나의 background에 대해 한 번에 read_statistics 한다.
+    Background는 한 번만 읽고, sample의 variant는 row 순서가 아니라 RefSeq key join으로 background에 맞춘다. 
+    모든 sample x variant의 OR, RPM, Fisher p-value를 한 번의 vectorized 계산 (fisher_exact_batch)으로 구한다.
+
+    Args:
+        samples (list or pd.DataFrame): List of Count_*.csv files, or a variants x samples count matrix (make_count_batch output='matrix').
+        background (str): Count file of the background (unedited) sample.
+        hit_label (str, optional): Label of variants to test. Defaults to 'SynPE'.
+        adjustment (str, optional): 'bonferroni' or 'BH'. Adjusted within each sample. Defaults to 'bonferroni'.
+        output (str, optional): 'long' for a long-format table of all samples, 'file' for Stat_{sample}.csv files. Defaults to 'long'.
+        save_path (str, optional): Directory for Stat_*.csv files ('file') or path of the long table csv ('long'). Defaults to None.
+
+    Raises:
+        ValueError: If the hit variants of a sample do not match those of the background.
+
+    Returns:
+        pd.DataFrame: Long-format table (sample, variant info, count, statistics columns of read_statistics).
+                      Each sample's rows are the same as read_statistics(sample, background).
+    """    
+
+    if adjustment not in ['bonferroni', 'BH']:
+        raise ValueError('Not available adjustment. Please select "bonferroni" or "BH".')
+    
+    if output not in ['long', 'file']:
+        raise ValueError('Not available output. Please select "long" or "file".')
+
+    # Step1: load background once and make key index
+    df_UE = pd.read_csv(background)
+
+    UE_WT_read  = df_UE[df_UE['Label']=='WT_refseq']['count'].iloc[0]
+    UE_SynPE_df = df_UE[df_UE['Label']==hit_label].reset_index(drop=True)
+
+    UE_SynPE_index = _SeqKeyIndex(UE_SynPE_df['RefSeq'])
+    UE_SynPE_count = UE_SynPE_df.groupby(UE_SynPE_index.codes)['count'].last().to_numpy(dtype=np.int64)
+
+    # Step2: load samples (Count files or columns of count matrix)
+    dict_sample = {}
+
+    if isinstance(samples, pd.DataFrame):
+        list_info = [col for col in samples.columns if col in df_UE.columns and col not in ['count', 'frequency']]
+        list_col  = [col for col in samples.columns if col not in list_info and col != 'Exon']
+        df_info   = samples[list_info]
+
+        for col in list_col:
+            is_exon = samples[col].notna()
+            dict_sample[col] = df_info[is_exon].assign(count=samples.loc[is_exon, col].astype(np.int64)).reset_index(drop=True)
+    else:
+        for f in samples:
+            dict_sample[os.path.basename(f).replace('.csv', '').replace('Count_', '')] = pd.read_csv(f)
+
+    print(f'[Info] Read statistics: {len(dict_sample)} samples')
+
+    # Step3: align hit variants of each sample to background by key join
+    list_df, list_pos, list_wt = [], [], []
+
+    for name, df_sample in dict_sample.items():
+        df_synpe = df_sample[df_sample['Label']==hit_label].reset_index(drop=True).copy()
+        pos      = UE_SynPE_index.lookup(df_synpe['RefSeq'])
+
+        if (pos < 0).any() or len(np.unique(pos)) != UE_SynPE_index.n_key:
+            raise ValueError(f'Not matched between sample ({name}) and background. Please check your input files.')
+
+        list_df.append(df_synpe)
+        list_pos.append(pos)
+        list_wt.append(np.full(len(df_synpe), df_sample[df_sample['Label']=='WT_refseq']['count'].iloc[0], dtype=np.int64))
+
+    # Step4: OR, RPM and Fisher test p-value of all samples at once
+    sample_no        = np.repeat(np.arange(len(list_df)), [len(df) for df in list_df])
+    sample_SynPE_cnt = np.concatenate([df['count'].to_numpy(dtype=np.int64) for df in list_df])
+    total_cnt_wtseq  = np.concatenate(list_wt)
+    total_cnt_edseq  = np.bincount(sample_no, weights=sample_SynPE_cnt, minlength=len(list_df))[sample_no]
+    unedit_SynPE_cnt = UE_SynPE_count[np.concatenate(list_pos)]
+
+    odds = ((sample_SynPE_cnt+1)/(total_cnt_wtseq+1))/((unedit_SynPE_cnt+1)/(UE_WT_read+1))
+
+    fisher_table = np.zeros((len(sample_no), 2, 2), dtype=np.int64)
+    fisher_table[:, 0, 0] = sample_SynPE_cnt
+    fisher_table[:, 0, 1] = total_cnt_wtseq
+    fisher_table[:, 1, 0] = unedit_SynPE_cnt
+    fisher_table[:, 1, 1] = UE_WT_read
+
+    _, pvalue = fisher_exact_batch(fisher_table)
+
+    # Step5: make output
+    df_out = pd.concat(list_df, ignore_index=True)
+    df_out.insert(0, 'sample', np.array(list(dict_sample), dtype=object)[sample_no])
+
+    df_out['Edited_WT_count'] = total_cnt_wtseq
+    df_out['RPM']             = sample_SynPE_cnt*1000000/total_cnt_edseq
+    df_out['UE_SynPE_count']  = unedit_SynPE_cnt
+    df_out['UE_WT_count']     = UE_WT_read
+    df_out['OR']              = odds
+    df_out['pvalue']          = pvalue
+
+    if adjustment == 'bonferroni':
+        df_out['adj_pvalue'] = df_out.groupby('sample', sort=False)['pvalue'].transform('size') * pvalue
+    else:
+        df_out['adj_pvalue'] = df_out.groupby('sample', sort=False)['pvalue'].transform(_bh_adjust)
+
+    if output == 'file':
+        if save_path != None: 
+            os.makedirs(save_path, exist_ok=True)
+
+            for name, df_stat in df_out.groupby('sample', sort=False):
+                df_stat.drop(columns='sample').to_csv(f'{save_path}/Stat_{name}.csv', index=False)
+
+    elif save_path != None: df_out.to_csv(save_path, index=False)
+
+    return df_out
+
+
 class VariantFilter:
-    def __init__(self, test_r1:str, test_r2:str, control_r1:str, control_r2:str):
+    def __init__(self, test_r1:str=None, test_r2:str=None, control_r1:str=None, control_r2:str=None, 
+                 tests:list=None, controls:list=None):
         """A function to generate filtered test data based on odds ratio/p-value criteria.
-        Always assumes there are replicates (two experimental groups).
+        Assumes there are replicates: two (test_r1/r2, control_r1/r2) or any number (tests/controls).
 
         Args:
             test_r1 (str): Read count file, replicate 1
             test_r2 (str): Read count file, replicate 2
             control_r1 (str): Control statistics containing odds ratio and fisher's t-test p-value, replicate 1
             control_r2 (str): Control statistics containing odds ratio and fisher's t-test p-value, replicate 2
+            tests (list, optional): Read count files of N replicates. Used instead of test_r1/test_r2.
+            controls (list, optional): Control statistics files of N replicates, same order as tests.
 
         Raises:
             FileNotFoundError: Not proper input file path.
+            ValueError: Number of test and control replicates are different.
         """        
 
+        if tests    == None: tests    = [test_r1, test_r2]
+        if controls == None: controls = [control_r1, control_r2]
+
+        if len(tests) != len(controls):
+            raise ValueError('Number of test and control replicates are different. Please check your input.')
+
         try: 
-            self.df1_test = pd.read_csv(test_r1)
-            self.df2_test = pd.read_csv(test_r2)
-            
-            self.df1_control = pd.read_csv(control_r1)
-            self.df2_control = pd.read_csv(control_r2)
+            self.list_test    = [pd.read_csv(f) for f in tests]
+            self.list_control = [pd.read_csv(f) for f in controls]
 
         except:
             raise FileNotFoundError('Not found statistics data. Please check your input.')
 
+        # Replicate 별 attribute (df1_test, df1_control, ...)
+        for n, (df_test, df_control) in enumerate(zip(self.list_test, self.list_control)):
+            setattr(self, f'df{n+1}_test', df_test)
+            setattr(self, f'df{n+1}_control', df_control)
+
 
-    def filter(self, hit_label:str='SynPE', OR_cutoff: float = 2, p_cutoff: float = 0.05, p_column:str='adj_pvalue', rpm_cutoff:float=10) -> pd.DataFrame:
+    def filter(self, hit_label:str='SynPE', OR_cutoff: float = 2, p_cutoff: float = 0.05, p_column:str='adj_pvalue', rpm_cutoff:float=10) -> tuple:
         """It takes Stats files containing odds ratio and Fisher's t-test p-values as input. Based on this, it filters variant reads.
         Then, it performs LOWESS regression using the log2-fold change (LFC) of synonymous mutations.
         After correcting the LFC with LOWESS regression, it calculates normalized LFC and returns a DataFrame containing their information.
@@ -178,88 +725,184 @@ class VariantFilter:
             rpm_cutoff (float, optional): _description_. Defaults to 10.
 
         Returns:
-            pd.DataFrame: _description_
+            tuple: Filtered DataFrame of each replicate (df1_out, df2_out, ...)
         """        
 
-        df1_test = self.df1_test.copy()
-        df2_test = self.df2_test.copy()
-        
-        df1_control = self.df1_control.copy()
-        df2_control = self.df2_control.copy()
-
-
-        # Step1: Selects only the mutations that emerge consistently in both Replicate 1 (R1) and Replicate 2 (R2) 
+        # Step1: Selects only the mutations that emerge consistently in all replicates 
         # among the sequences exceeding the OR/p-value cutoff and inducing mutations in the coding sequence (CDS).
 
-        df1_filtered = df1_control[(df1_control['OR']>OR_cutoff) & (df1_control[p_column]<p_cutoff) & (df1_control['RPM']>=rpm_cutoff)].copy()
-        df2_filtered = df2_control[(df2_control['OR']>OR_cutoff) & (df2_control[p_column]<p_cutoff) & (df2_control['RPM']>=rpm_cutoff)].copy()
-
-        # Ensures that only those passing through the intersection of Replicate 1 and Replicate 2 are displayed.
-        filtered_RefSeq = list(set(df1_filtered['RefSeq']) & set(df2_filtered['RefSeq']))
+        list_filtered = [df[(df['OR']>OR_cutoff) & (df[p_column]<p_cutoff) & (df['RPM']>=rpm_cutoff)] for df in self.list_control]
 
-        df1_filtered = df1_filtered[df1_filtered['RefSeq'].isin(filtered_RefSeq)].copy()
-        df2_filtered = df2_filtered[df2_filtered['RefSeq'].isin(filtered_RefSeq)].copy()
+        # Ensures that only those passing through the intersection of all replicates are displayed.
+        filtered_RefSeq = pd.Index(list_filtered[0]['RefSeq'])
 
-        df1_filtered = df1_filtered[['RefSeq', 'AA_var', 'SNV_var', 'RPM']]
-        df2_filtered = df2_filtered[['RefSeq', 'AA_var', 'SNV_var', 'RPM']]
+        for df in list_filtered[1:]: filtered_RefSeq = filtered_RefSeq.intersection(df['RefSeq'])
 
-        df1_filtered.columns = ['RefSeq', 'AA_var', 'SNV_var', 'control']
-        df2_filtered.columns = ['RefSeq', 'AA_var', 'SNV_var', 'control']
+        list_out = []
 
+        for df_filtered, df_test in zip(list_filtered, self.list_test):
+            df_filtered = df_filtered.loc[df_filtered['RefSeq'].isin(filtered_RefSeq), ['RefSeq', 'AA_var', 'SNV_var', 'RPM']].copy()
+            df_filtered.columns = ['RefSeq', 'AA_var', 'SNV_var', 'control']
 
-        # Step 2: Retrieves read counts only for the sequences that pass the cutoff and formats them into a Mageck count file.
-        df1_test_Syn = df1_test[df1_test['Label']==hit_label].copy()
-        df1_test_Syn['RPM'] = df1_test_Syn['count'] * 1000000 / np.sum(df1_test_Syn['count'])
-        df1_test_dict = dict(zip(df1_test_Syn['RefSeq'], df1_test_Syn['RPM']))
-        df1_filtered['test'] = [df1_test_dict.get(i) for i in df1_filtered['RefSeq']]
-        df1_filtered.dropna(axis = 0, inplace=True)
+            # Step 2: Retrieves read counts only for the sequences that pass the cutoff and formats them into a Mageck count file.
+            df_test_Syn = df_test[df_test['Label']==hit_label].copy()
+            df_test_Syn['RPM'] = df_test_Syn['count'] * 1000000 / np.sum(df_test_Syn['count'])
+            test_rpm = df_test_Syn.drop_duplicates('RefSeq', keep='last').set_index('RefSeq')['RPM']
 
-        df2_test_Syn = df2_test[df2_test['Label']==hit_label].copy()
-        df2_test_Syn['RPM'] = df2_test_Syn['count'] * 1000000 / np.sum(df2_test_Syn['count'])
-        df2_test_dict = dict(zip(df2_test_Syn['RefSeq'], df2_test_Syn['RPM']))
-        df2_filtered['test'] = [df2_test_dict.get(i) for i in df2_filtered['RefSeq']]
-        df2_filtered.dropna(axis = 0, inplace=True)
+            df_filtered['test'] = test_rpm.reindex(df_filtered['RefSeq']).to_numpy()
+            df_filtered.dropna(axis = 0, inplace=True)
 
+            # Step3: SNV sum
+            list_out.append(self._sum_SNV(df_filtered))
 
-        # Step3: SNV sum
-        df1_out = self._sum_SNV(df1_filtered)
-        df2_out = self._sum_SNV(df2_filtered)
-
-        return df1_out, df2_out
+        return tuple(list_out)
     
 
     def _sum_SNV(self, df:pd.DataFrame) -> pd.DataFrame:
+        """Sum control/test RPM per SNV_var (AA_var of the first row of each SNV_var)."""
 
-        df = df[['SNV_var', 'AA_var', 'control', 'test']].copy()
-
-        final_list_aavar = list()
-        final_dict_ctrl  = dict()
-        final_dict_test  = dict()
+        df = df[['SNV_var', 'AA_var', 'control', 'test']]
 
-        for i in range(len(df)):
-            SNV_var = df.iloc[i]['SNV_var']
-            AA_var  = df.iloc[i]['AA_var']
-            ctrl = df.iloc[i]['control']
-            test = df.iloc[i]['test']
+        df_sum = df.groupby('SNV_var', sort=False, dropna=False)[['control', 'test']].sum()
+        df_aa  = df.drop_duplicates('SNV_var')
 
-            if SNV_var in final_dict_ctrl:
-                final_dict_ctrl[SNV_var] = final_dict_ctrl[SNV_var] + ctrl
-                final_dict_test[SNV_var] = final_dict_test[SNV_var] + test
-            else:
-                final_dict_ctrl[SNV_var] = ctrl
-                final_dict_test[SNV_var] = test
-                final_list_aavar.append(AA_var)
-        
         df_normalized = pd.DataFrame({
-            'SNV_var':final_dict_ctrl.keys(), 
-            'AA_var' : final_list_aavar,
-            'control': final_dict_ctrl.values(), 
-            'test'   : final_dict_test.values(),
+            'SNV_var': df_aa['SNV_var'].to_numpy(), 
+            'AA_var' : df_aa['AA_var'].to_numpy(),
+            'control': df_sum['control'].to_numpy(), 
+            'test'   : df_sum['test'].to_numpy(),
             })
         
         return df_normalized
 
 
+def _tricube(dist:np.ndarray, threshold:np.ndarray) -> np.ndarray:
+    '''LOWESS tricube weight (moepy와 동일: threshold가 0이면 nan)'''
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (1 - (np.abs(dist) / threshold).clip(0, 1) ** 3) ** 3
+
+
+def _lowess_grid(list_x:list, list_y:list, list_x_pred:list, frac:float=0.15, robust_iters:int=3, block_size:int=2**24) -> list:
+    """여러 sample의 LOWESS regression을 integer position grid 위에서 한 번에 fit / predict 한다.
+    moepy.lowess.Lowess (fit: robust_iters, predict: x_pred)와 같은 계산을 grid position 단위로 vectorize 했다.
+
+    - Position 범위가 같은 sample (e.g. 같은 exon)끼리 묶어서 같은 integer grid를 쓰고, 
+      grid 사이의 거리와 정렬 순서는 한 번만 계산한다. Sample 마다 position별 개수 (multiplicity)로 tricube threshold / weight를 구한다.
+    - Local regression (anchor = position)은 2x2 normal equation을 batch로 푼다.
+    - Prediction은 grid position에서 계산한 뒤 position lookup으로 돌려준다.
+
+    Args:
+        list_x (list): Positions (integer) used for fitting, per sample.
+        list_y (list): Values used for fitting, per sample.
+        list_x_pred (list): Positions to predict, per sample.
+        frac (float, optional): LOWESS bandwidth. Defaults to 0.15.
+        robust_iters (int, optional): Number of fits including robustifying iterations (1: no robustness). Defaults to 3.
+        block_size (int, optional): Maximum size of (sample x grid x grid) array computed at once. Defaults to 2**24.
+
+    Returns:
+        list: Predicted values at list_x_pred, per sample.
+    """
+
+    list_x      = [np.asarray(x, dtype=np.int64) for x in list_x]
+    list_y      = [np.asarray(y, dtype=np.float64) for y in list_y]
+    list_x_pred = [np.asarray(x, dtype=np.int64) for x in list_x_pred]
+
+    # Position 범위 (min, max)가 같은 sample끼리 grid를 공유한다
+    dict_group = {}
+
+    for n, (x, x_pred) in enumerate(zip(list_x, list_x_pred)):
+        pos = np.concatenate([x, x_pred])
+        dict_group.setdefault((pos.min(), pos.max()), []).append(n)
+
+    list_pred = [None] * len(list_x)
+
+    for (lo, hi), list_idx in dict_group.items():
+        grid    = np.arange(lo, hi + 1)
+        n_block = max(1, block_size // (len(grid) ** 2))
+
+        for start in range(0, len(list_idx), n_block):
+            idx = list_idx[start:start+n_block]
+            
+            for n, y_pred in zip(idx, _lowess_block(grid, [list_x[n] for n in idx], [list_y[n] for n in idx], 
+                                                    [list_x_pred[n] for n in idx], frac, robust_iters)):
+                list_pred[n] = y_pred
+
+    return list_pred
+
+
+def _lowess_block(grid:np.ndarray, xs:list, ys:list, xps:list, frac:float, robust_iters:int) -> list:
+    '''_lowess_grid의 block 하나 (같은 grid를 쓰는 sample들)를 계산한다.'''
+
+    G = len(grid)
+    g = grid.astype(np.float64)
+
+    # Step1: distance between grid positions and its sorted order (shared by all samples)
+    dist  = np.abs(g[:, None] - g[None, :])
+    order = np.argsort(dist, axis=1, kind='stable')
+    dist_sorted = np.take_along_axis(dist, order, axis=1)
+
+    def weights(cnt:np.ndarray) -> np.ndarray:
+        '''Tricube weight (sample x anchor x position). Threshold = frac 번째로 가까운 point까지의 거리 (multiplicity 포함)'''
+        frac_idx = np.ceil(cnt.sum(axis=1) * frac).astype(np.int64) - 1
+        k        = (np.cumsum(cnt[:, order], axis=2) > frac_idx[:, None, None]).argmax(axis=2)
+        return _tricube(dist[None], dist_sorted[np.arange(G)[None, :], k][:, :, None])
+
+    def normalize(W:np.ndarray, cnt_anchor:np.ndarray) -> np.ndarray:
+        '''Anchor (multiplicity 포함) 방향으로 weight 합이 1이 되도록 normalize, non-finite는 0'''
+        is_anchor = cnt_anchor[:, :, None] > 0
+        colsum    = np.where(is_anchor, W * cnt_anchor[:, :, None], 0).sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            W = W / colsum[:, None, :]
+        return np.where(np.isfinite(W) & is_anchor, W, 0)
+
+    def evaluate(Wn:np.ndarray, cnt_anchor:np.ndarray, betas:np.ndarray) -> np.ndarray:
+        '''Grid position 마다 local regression 값의 weighted sum'''
+        Wc = Wn * cnt_anchor[:, :, None]
+        return np.einsum('sag,sa->sg', Wc, betas[:, :, 0]) + np.einsum('sag,sa->sg', Wc, betas[:, :, 1]) * g[None, :]
+
+    ix    = [x - grid[0] for x in xs]
+    cnt_x = np.stack([np.bincount(i, minlength=G) for i in ix]).astype(np.float64)
+    cnt_p = np.stack([np.bincount(x - grid[0], minlength=G) for x in xps]).astype(np.float64)
+
+    # Step2: fitting weights (anchor = fitting points)
+    Wn = normalize(weights(cnt_x), cnt_x)
+
+    list_mask = [np.ones(len(x)) for x in xs]
+
+    for it in range(robust_iters):
+        # Step3: weighted linear regression per anchor (robust weight는 0/nan인 point만 제외된다)
+        M = np.stack([np.bincount(i, weights=m, minlength=G) for i, m in zip(ix, list_mask)])
+        Y = np.stack([np.bincount(i, weights=m * y, minlength=G) for i, m, y in zip(ix, list_mask, ys)])
+
+        S0, S1, S2 = np.einsum('sag,sg->sa', Wn, M), np.einsum('sag,sg->sa', Wn, M * g), np.einsum('sag,sg->sa', Wn, M * g * g)
+        T0, T1     = np.einsum('sag,sg->sa', Wn, Y), np.einsum('sag,sg->sa', Wn, Y * g)
+
+        A = np.stack([np.stack([S0, S1], -1), np.stack([S1, S2], -1)], -2)
+        b = np.stack([T0, T1], -1)
+
+        betas = np.einsum('saij,saj->sai', np.linalg.pinv(A, rcond=2 * np.finfo(np.float64).eps), b)
+
+        if it == robust_iters - 1: break
+
+        # Step4: robustifying weights from residuals of current fit
+        y_fit = evaluate(Wn, cnt_x, betas)
+
+        for n, (i, y) in enumerate(zip(ix, ys)):
+            residuals = y - y_fit[n, i]
+            std_dev   = np.quantile(np.abs(residuals), 0.682)
+
+            with np.errstate(divide='ignore', invalid='ignore'):
+                robust_weights = (1 - np.clip(residuals / (6 * std_dev), -1, 1) ** 2) ** 2
+
+            list_mask[n] = (np.isfinite(robust_weights) & (robust_weights != 0)).astype(np.float64)
+
+    # Step5: prediction on grid (threshold from x_pred points) and position lookup
+    y_pred = evaluate(normalize(weights(cnt_p), cnt_x), cnt_x, betas)
+
+    return [y_pred[n, x - grid[0]] for n, x in enumerate(xps)]
+
+
 class Normalizer:
     def __init__(self, ):
 
@@ -274,32 +917,36 @@ class Normalizer:
         df_out['raw_LFC'] = np.log2(((df_out[test] + 1) / (df_out[control] + 1)))
         
         #2 : Retrieve position information.
-        df_out['var_pos'] = [id.split('pos')[-1][:-3] for id in df_out['SNV_var']]
+        df_out['var_pos'] = df_out['SNV_var'].str.replace(r'^.*pos', '', regex=True).str[:-3]
         
         #3 : Add SNV mutation class label (Nonsense/missense/Synonymous). Requires reference info.
-        list_mut_type = []
-        for aa_var in df_out['AA_var']:
-            if   aa_var.endswith('Stop'): list_mut_type.append('Nonsense')
-            elif aa_var[0] == aa_var[-1]: list_mut_type.append('Synonymous')
-            else: list_mut_type.append('Missense')
-                
-        df_out['mut_type'] = list_mut_type
+        aa_var = df_out['AA_var']
+        df_out['mut_type'] = np.select([aa_var.str.endswith('Stop'), aa_var.str[0] == aa_var.str[-1]], 
+                                       ['Nonsense', 'Synonymous'], default='Missense')
 
         return df_out
 
 
-    def lowess(self, data:pd.DataFrame, frac:float=0.15, control:str='control', test:str='test') -> pd.DataFrame:
+    def lowess(self, data:pd.DataFrame, frac:float=0.15, control:str='control', test:str='test', 
+               robust_iters:int=3, engine:str='numpy') -> pd.DataFrame:
         """The result of performing LOWESS normalization on the SNV sum count file.
 
         Args:
             data (pd.DataFrame): _description_
             exclude (_type_, optional): _description_. Defaults to None.
             frac (float, optional): _description_. Defaults to 0.15.
+            robust_iters (int, optional): Number of LOWESS fits including robustifying iterations. Defaults to 3.
+            engine (str, optional): 'numpy' (vectorized, _lowess_grid) or 'moepy'. Defaults to 'numpy'.
 
         Returns:
             pd.DataFrame: _description_
         """
 
+        if engine == 'numpy': return self.lowess_batch([data], frac, control, test, robust_iters)[0]
+        
+        if engine != 'moepy':
+            raise ValueError('Not available engine. Please select "numpy" or "moepy".')
+
         df_snv_sum = data.copy()
         df_snv_sum = self._make_variants_info(df_snv_sum, control, test)
         
@@ -312,7 +959,7 @@ class Normalizer:
         syn_std = np.std(df_syn['raw_LFC'])
 
         lowess_model = lowess.Lowess()
-        lowess_model.fit(x, y, frac=frac)
+        lowess_model.fit(x, y, frac=frac, robust_iters=robust_iters)
 
         x_pred = np.array([pos for pos in df_snv_sum['var_pos']], dtype=np.int64)
         y_pred = lowess_model.predict(x_pred)
@@ -323,6 +970,40 @@ class Normalizer:
         df_nor[f'normalized_LFC'] = (df_nor['raw_LFC'] - df_nor[f'lws_reg']) / syn_std
 
         return df_nor
+
+
+    def lowess_batch(self, list_data:list, frac:float=0.15, control:str='control', test:str='test', robust_iters:int=3) -> list:
+        """LOWESS normalization of many samples (e.g. sample x drug) at once on the shared position grid.
+        Each result is the same as lowess(data, engine='moepy') within numerical tolerance.
+
+        Args:
+            list_data (list): SNV sum count DataFrames (VariantFilter.filter output).
+            frac (float, optional): LOWESS bandwidth. Defaults to 0.15.
+            robust_iters (int, optional): Number of LOWESS fits including robustifying iterations. Defaults to 3.
+
+        Returns:
+            list: Normalized DataFrame of each sample.
+        """
+
+        list_snv_sum = [self._make_variants_info(data.copy(), control, test) for data in list_data]
+        list_syn     = [df[df['mut_type']=='Synonymous'] for df in list_snv_sum]
+
+        list_pred = _lowess_grid([df['var_pos'].astype(np.int64) for df in list_syn], 
+                                 [df['raw_LFC'] for df in list_syn], 
+                                 [df['var_pos'].astype(np.int64) for df in list_snv_sum], 
+                                 frac=frac, robust_iters=robust_iters)
+
+        list_nor = []
+
+        for df_nor, df_syn, y_pred in zip(list_snv_sum, list_syn, list_pred):
+            syn_std = np.std(df_syn['raw_LFC'])
+
+            df_nor[f'lws_reg'] = y_pred
+            df_nor[f'normalized_LFC'] = (df_nor['raw_LFC'] - df_nor[f'lws_reg']) / syn_std
+
+            list_nor.append(df_nor)
+
+        return list_nor
     
     
     def zscore(self, df:pd.DataFrame, control:str='control', test:str='test') -> pd.DataFrame:
@@ -343,6 +1024,174 @@ def combine_data(files:list) -> pd.DataFrame:
     return pd.concat(list_df, axis = 0).reset_index(drop=True)
 
 
+_CLASS_LABEL = np.array(['Sensitive', 'Intermediate', 'Resistant'], dtype=object)
+
+def _score_nlfc(nlfc:np.ndarray, is_syn:np.ndarray, sensitive_cutoff:float, resistant_cutoff:float) -> tuple:
+    '''nLFC array (bootstrap x variant x replicate)의 score (replicate 평균)와 class code (0: Sensitive, 1: Intermediate, 2: Resistant).
+    VariantScore._classification과 같이 synonymous quantile cut-off를 bootstrap x replicate 별로 구한다.'''
+
+    syn    = nlfc[:, is_syn, :]
+    q_res  = np.nanquantile(syn, resistant_cutoff, axis=1)[:, None, :]
+    q_sens = np.nanquantile(syn, sensitive_cutoff, axis=1)[:, None, :]
+
+    is_resistant = (nlfc > q_res).all(axis=2)
+    is_sensitive = (nlfc < q_sens).all(axis=2) & ~is_resistant
+
+    with np.errstate(invalid='ignore'):
+        n_valid = (~np.isnan(nlfc)).sum(axis=2)
+        score   = np.where(n_valid > 0, np.nansum(nlfc, axis=2) / n_valid, np.nan)
+
+    return score, np.where(is_resistant, 2, np.where(is_sensitive, 0, 1)).astype(np.int8)
+
+
+def _mean_by_aa(nlfc:np.ndarray, aa_onehot:sparse.csr_matrix) -> np.ndarray:
+    '''SNV 단위 nLFC (bootstrap x SNV x replicate)를 AA_var 단위 평균 (NaN 제외)으로 바꾼다.'''
+
+    B, n_var, R = nlfc.shape
+    X = np.moveaxis(nlfc, 1, 2).reshape(B * R, n_var)
+
+    total = np.asarray(aa_onehot.T.dot(np.nan_to_num(X).T)).T
+    count = np.asarray(aa_onehot.T.dot((~np.isnan(X)).astype(np.float64).T)).T
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = total / count
+
+    return np.moveaxis(mean.reshape(B, R, -1), 1, 2)
+
+
+def _normalize_lfc(lfc:np.ndarray, pos:np.ndarray, is_syn:np.ndarray, group:np.ndarray, frac:float, robust_iters:int) -> np.ndarray:
+    '''Normalizer.lowess와 같은 normalized LFC를 bootstrap x variant array로 계산한다 (group (exon) 별 LOWESS, _lowess_grid).'''
+
+    B = len(lfc)
+    list_x, list_y, list_xp, list_idx = [], [], [], []
+
+    for g in np.unique(group):
+        idx, idx_syn = np.where(group == g)[0], np.where((group == g) & is_syn)[0]
+
+        list_x   += [pos[idx_syn]] * B
+        list_y   += list(lfc[:, idx_syn])
+        list_xp  += [pos[idx]] * B
+        list_idx.append((idx, idx_syn))
+
+    list_pred = _lowess_grid(list_x, list_y, list_xp, frac=frac, robust_iters=robust_iters)
+    nlfc      = np.full(lfc.shape, np.nan)
+
+    for n, (idx, idx_syn) in enumerate(list_idx):
+        y_pred  = np.stack(list_pred[n * B:(n + 1) * B])
+        syn_std = np.std(lfc[:, idx_syn], axis=1)
+
+        nlfc[:, idx] = (lfc[:, idx] - y_pred) / syn_std[:, None]
+
+    return nlfc
+
+
+def _bootstrap_chunk(job:tuple) -> tuple:
+    '''Worker: n_boot 번 read count를 multinomial resampling 하고 RPM -> LFC -> normalization -> score/classification을 계산한다.'''
+
+    seed, n_boot, param = job
+
+    rng  = np.random.default_rng(seed)
+    nlfc = np.full((n_boot, param['n_var'], len(param['rep'])), np.nan)
+
+    for r, rep in enumerate(param['rep']):
+        list_rpm = []
+
+        for cnt, depth in [(rep['control_cnt'], rep['control_depth']), (rep['test_cnt'], rep['test_depth'])]:
+            rpm = np.zeros((n_boot, len(cnt)))
+
+            # 각 exon은 따로 sequencing 된 library이므로 group 별로 resampling
+            for g in np.unique(rep['group']):
+                idx = np.where(rep['group'] == g)[0]
+                rpm[:, idx] = rng.multinomial(int(cnt[idx].sum()), cnt[idx] / cnt[idx].sum(), size=n_boot) * 1000000 / depth[idx]
+
+            list_rpm.append(rpm)
+
+        lfc = np.log2((list_rpm[1] + 1) / (list_rpm[0] + 1))
+
+        nlfc[:, rep['row'], r] = _normalize_lfc(lfc, rep['pos'], rep['is_syn'], rep['group'], param['frac'], param['robust_iters'])
+
+    if param['aa_onehot'] is not None: nlfc = _mean_by_aa(nlfc, param['aa_onehot'])
+
+    return _score_nlfc(nlfc, param['is_syn'], param['sensitive_cutoff'], param['resistant_cutoff'])
+
+
+def _read_depth(depth, group_names:np.ndarray, hit_label:str='SynPE') -> np.ndarray:
+    '''RPM 계산에 사용된 total read 수 (group (exon) 별). 숫자 또는 Count/Stat file (hit_label count의 합),
+    여러 exon이 합쳐진 file은 {'exon4': depth, ...} dict로 입력한다.'''
+
+    if isinstance(depth, dict):
+        depth = {str(k).lower(): v for k, v in depth.items()}
+        missing = set(group_names) - set(depth)
+        if missing: raise ValueError(f'Depth of {sorted(missing)} is not found. Please check your input depth.')
+
+        return np.array([_read_depth(depth[g], [g], hit_label)[0] for g in group_names], dtype=np.float64)
+
+    if isinstance(depth, str):
+        df = pd.read_csv(depth)
+        depth = df[df['Label']==hit_label]['count'].sum()
+
+    return np.full(len(group_names), depth, dtype=np.float64)
+
+
+def _matched_synonymous(pos:np.ndarray, group:np.ndarray, is_syn:np.ndarray, n_neighbors:int) -> tuple:
+    '''각 variant와 같은 group (exon)에서 position이 가장 가까운 synonymous variant index (padded)와 그 수.
+    Synonymous variant 자신은 neighbor에서 제외한다.'''
+
+    k = min(n_neighbors, max(np.bincount(group[is_syn], minlength=group.max() + 1).max(), 1))
+    neighbor   = np.zeros((len(pos), k), dtype=np.int64)
+    n_neighbor = np.zeros(len(pos), dtype=np.int64)
+
+    for g in np.unique(group):
+        idx, idx_syn = np.where(group == g)[0], np.where((group == g) & is_syn)[0]
+        if len(idx_syn) == 0: continue
+
+        # 자기 자신은 거리를 inf로 두어 마지막으로 보내고, neighbor 수에서 뺀다
+        dist = np.abs(pos[idx][:, None] - pos[idx_syn][None, :]).astype(np.float64)
+        dist[idx[:, None] == idx_syn[None, :]] = np.inf
+
+        k_g   = min(k, len(idx_syn))
+        order = np.argsort(dist, axis=1, kind='stable')[:, :k_g]
+
+        neighbor[idx, :k_g] = idx_syn[order]
+        n_neighbor[idx]     = np.minimum(k_g, len(idx_syn) - is_syn[idx])
+
+    return neighbor, n_neighbor
+
+
+def _permutation_chunk(job:tuple) -> tuple:
+    '''Worker: n_perm 번 replicate 별로 가장 가까운 synonymous variant 중 하나를 복원추출 (with replacement)해서 
+    그 nLFC로 null score를 만들고, 관측 score 이상 / 이하인 null의 수를 센다.'''
+
+    seed, n_perm, param = job
+
+    rng = np.random.default_rng(seed)
+    nlfc, score, neighbor, n_neighbor = param['nlfc'], param['score'], param['neighbor'], param['n_neighbor']
+
+    n_unit, R = nlfc.shape
+    is_valid  = ~np.isnan(nlfc)
+    n_valid   = is_valid.sum(axis=1)
+    testable  = (n_neighbor > 0) & (n_valid > 0)
+
+    count_ge = np.zeros(n_unit, dtype=np.int64)
+    count_le = np.zeros(n_unit, dtype=np.int64)
+    step     = max(1, param['block_size'] // (n_unit * R))
+
+    for start in range(0, n_perm, step):
+        n = min(step, n_perm - start)
+
+        pick  = (rng.random((n, n_unit, R)) * n_neighbor[None, :, None]).astype(np.int64)
+        syn   = neighbor[np.arange(n_unit)[None, :, None], pick]
+        null  = np.where(is_valid[None], nlfc[syn, np.arange(R)[None, None, :]], 0).sum(axis=2) / np.maximum(n_valid, 1)
+
+        count_ge += (null >= score).sum(axis=0)
+        count_le += (null <= score).sum(axis=0)
+
+    count_ge[~testable] = -1
+    count_le[~testable] = -1
+
+    return count_ge, count_le
+
+
 class VariantScore:
     def __init__(self):
 
@@ -401,15 +1250,12 @@ class VariantScore:
 
         df = df_adjLFC.copy()
 
-        dict_mut_type = {}
-        for idx in df.index:
-            data = df.loc[idx]
-            dict_mut_type[data['AA_var']] = data['mut_type']
+        dict_mut_type = df.drop_duplicates('AA_var', keep='last').set_index('AA_var')['mut_type']
 
         aa_df = df.groupby('AA_var').mean(numeric_only=True)[['raw_LFC_1', 'raw_LFC_2', 'nLFC_1', 'nLFC_2']]
         
         aa_df['Resistance_score'] = aa_df[['nLFC_1', 'nLFC_2']].mean(axis = 1)
-        aa_df['mut_type'] = [dict_mut_type[AA_var] for AA_var in aa_df.index]
+        aa_df['mut_type'] = dict_mut_type.reindex(aa_df.index).to_numpy()
 
         aa_df = self._classification(aa_df)
 
@@ -424,20 +1270,300 @@ class VariantScore:
         senseitive_1 = synonymous_df['nLFC_1'].quantile(self.sens_cutoff)
         senseitive_2 = synonymous_df['nLFC_2'].quantile(self.sens_cutoff)
 
-        def label(row):
-            if row['nLFC_1'] > resistant_1 and row['nLFC_2'] > resistant_2:
-                return 'Resistant'
-            elif row['nLFC_1'] < senseitive_1 and row['nLFC_2'] < senseitive_2 :
-                return 'Sensitive'
-            else:
-                return 'Intermediate'
+        is_resistant = (df['nLFC_1'] > resistant_1) & (df['nLFC_2'] > resistant_2)
+        is_sensitive = (df['nLFC_1'] < senseitive_1) & (df['nLFC_2'] < senseitive_2)
             
-        df['Classification'] = df.apply(label, axis = 1)
+        df['Classification'] = np.select([is_resistant, is_sensitive], ['Resistant', 'Sensitive'], default='Intermediate')
 
         return df
 
 
+    def bootstrap(self, replicates:list, depth:list, var_type:str='SNV', n_boot:int=1000, ci:float=0.95, 
+                  frac:float=0.15, robust_iters:int=3, sensitive_cutoff:int=0.95, resistant_cutoff:int=0.997, 
+                  hit_label:str='SynPE', n_jobs:int=4, seed:int=0) -> pd.DataFrame:
+        """Bootstrap confidence interval과 classification stability를 계산한다.
+        각 replicate의 control/test read count를 multinomial로 resampling 하고 RPM -> raw LFC -> LOWESS normalization (exon 별) -> 
+        score/classification을 NumPy array 단위로 다시 계산한다. Bootstrap은 worker process들에 나눠서 계산한다.
+
+        Args:
+            replicates (list): Paths to the normalized (Filtered_*) files of each replicate.
+            depth (list): (control_depth, test_depth) of each replicate. Total read count used for RPM, 
+                          or path to the Stat/Count file (sum of hit_label counts).
+                          For multi-exon files, dict of exon (SNV_var prefix, e.g. 'exon4') and depth.
+            var_type (str, optional): SNV 또는 AA 중에 선택할 수 있다. Defaults to 'SNV'.
+            n_boot (int, optional): Number of bootstrap samples. Defaults to 1000.
+            ci (float, optional): Confidence level of interval. Defaults to 0.95.
+            frac (float, optional): LOWESS bandwidth used for the normalization. Defaults to 0.15.
+            robust_iters (int, optional): Number of LOWESS fits including robustifying iterations. Defaults to 3.
+            sensitive_cutoff (int, optional): Sensitive-Intermediate 구분에 사용되는 synonymous score cut-off. Defaults to 0.95.
+            resistant_cutoff (int, optional): Resistant-Intermediate 구분에 사용되는 synonymous score cut-off. Defaults to 0.997.
+            hit_label (str, optional): Label used for depth from Stat/Count file. Defaults to 'SynPE'.
+            n_jobs (int, optional): Number of worker processes. Defaults to 4.
+            seed (int, optional): Random seed. Defaults to 0.
+
+        Raises:
+            ValueError: Occurs when an invalid value is entered for `var_type`.
+
+        Returns:
+            pd.DataFrame: Index SNV_var (or AA_var). Point score (Adjusted_LFC or Resistance_score) and Classification,
+                          CI_low/CI_high, Stability (fraction of bootstraps with the same class) and P_Resistant/P_Sensitive.
+        """        
+
+        if var_type not in ['SNV', 'AA']:
+            raise ValueError('Not available variants type. Please select "SNV" or "AA".')
+        
+        if len(replicates) != len(depth):
+            raise ValueError('Number of replicates and depth are different. Please check your input.')
+
+        # Step1: variants of all replicates and their info
+        list_df = [pd.read_csv(rep).set_index('SNV_var') for rep in replicates]
+
+        df_info = pd.concat([df[['AA_var', 'mut_type']] for df in list_df])
+        df_info = df_info[~df_info.index.duplicated(keep='first')]
+        n_var   = len(df_info)
+
+        list_rep  = []
+        nlfc_file = np.full((1, n_var, len(list_df)), np.nan)
+
+        for r, (df, (control_depth, test_depth)) in enumerate(zip(list_df, depth)):
+            group, group_names = pd.factorize(df.index.str.replace(r'_?pos.*$', '', regex=True).str.lower())
+            control_depth = _read_depth(control_depth, group_names, hit_label)[group]
+            test_depth    = _read_depth(test_depth, group_names, hit_label)[group]
+            row = df_info.index.get_indexer(df.index)
+
+            list_rep.append({
+                'row'          : row,
+                'pos'          : df['var_pos'].astype(np.int64).to_numpy(),
+                'is_syn'       : (df['mut_type'] == 'Synonymous').to_numpy(),
+                'group'        : group,
+                'control_cnt'  : np.rint(df['control'].to_numpy() * control_depth / 1000000),
+                'control_depth': control_depth,
+                'test_cnt'     : np.rint(df['test'].to_numpy() * test_depth / 1000000),
+                'test_depth'   : test_depth,
+            })
+
+            nlfc_file[0, row, r] = df['normalized_LFC'].to_numpy()
+
+        # Step2: SNV -> AA mapping (AA mode)
+        if var_type == 'AA':
+            aa_var = df_info['AA_var']
+            aa_codes, aa_index = pd.factorize(aa_var, sort=True)
+            is_aa = aa_codes >= 0
+
+            aa_onehot = sparse.csr_matrix((np.ones(is_aa.sum()), (np.where(is_aa)[0], aa_codes[is_aa])), shape=(n_var, len(aa_index)))
+            mut_type  = df_info.dropna(subset=['AA_var']).drop_duplicates('AA_var', keep='last').set_index('AA_var')['mut_type'].reindex(aa_index)
+            df_out    = pd.DataFrame({'mut_type': mut_type.to_numpy()}, index=pd.Index(aa_index, name='AA_var'))
+            nlfc_file = _mean_by_aa(nlfc_file, aa_onehot)
+        else:
+            aa_onehot = None
+            df_out    = df_info.copy()
+
+        is_syn = (df_out['mut_type'] == 'Synonymous').to_numpy()
+
+        # Step3: point estimate (normalized LFC of files) and bootstrap in worker processes
+        score, code = _score_nlfc(nlfc_file, is_syn, sensitive_cutoff, resistant_cutoff)
+
+        param = {'n_var': n_var, 'rep': list_rep, 'frac': frac, 'robust_iters': robust_iters, 'aa_onehot': aa_onehot, 
+                 'is_syn': is_syn, 'sensitive_cutoff': sensitive_cutoff, 'resistant_cutoff': resistant_cutoff}
+
+        n_chunk   = min(n_boot, n_jobs * 4)
+        list_seed = np.random.SeedSequence(seed).spawn(n_chunk)
+        list_job  = [(sd, n, param) for sd, n in zip(list_seed, np.diff(np.linspace(0, n_boot, n_chunk + 1).astype(int))) if n > 0]
+
+        with Pool(n_jobs) as pool:
+            list_result = list(tqdm(pool.imap(_bootstrap_chunk, list_job), total=len(list_job), 
+                                    desc='Bootstrap', ncols=70, ascii=' ='))
+
+        boot_score = np.concatenate([r[0] for r in list_result])
+        boot_code  = np.concatenate([r[1] for r in list_result])
+
+        # Step4: make output
+        score_name = 'Adjusted_LFC' if var_type == 'SNV' else 'Resistance_score'
+        alpha      = (1 - ci) / 2 * 100
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', category=RuntimeWarning) # all-NaN variants
+            ci_low, ci_high = np.nanpercentile(boot_score, [alpha, 100 - alpha], axis=0)
+
+        df_out[score_name]       = score[0]
+        df_out['CI_low']         = ci_low
+        df_out['CI_high']        = ci_high
+        df_out['Classification'] = _CLASS_LABEL[code[0]]
+        df_out['Stability']      = (boot_code == code).mean(axis=0)
+        df_out['P_Resistant']    = (boot_code == 2).mean(axis=0)
+        df_out['P_Sensitive']    = (boot_code == 0).mean(axis=0)
+
+        return df_out
+
+
+    def permutation_test(self, replicates:list, var_type:str='SNV', n_perm:int=10000, n_neighbors:int=50, 
+                         fdr_cutoff:float=0.05, sensitive_pvalue:float=0.05, n_jobs:int=4, seed:int=0) -> pd.DataFrame:
+        """Synonymous variant로 만든 empirical null distribution으로 variant 별 resistance p-value와 FDR을 계산한다.
+        각 variant의 null은 같은 exon에서 position이 가까운 n_neighbors개의 synonymous variant이고 (position-matched, 
+        synonymous variant 자신은 제외), 매 resampling마다 replicate 별로 독립적으로 이 중 하나를 복원추출 (with replacement)해서 
+        null score (replicate 평균 nLFC)를 만든다. Label permutation이 아니라 nearest synonymous variant의 resampling이다.
+        Resampling은 NumPy array로 block 단위로 계산하고 worker process들에 나눠서 계산한다.
+
+        Classification: FDR < fdr_cutoff이면 Resistant, p-value > sensitive_pvalue이면 Sensitive, 그 외는 Intermediate.
+
+        Args:
+            replicates (list): Paths to the normalized (Filtered_*) files of each replicate.
+            var_type (str, optional): SNV 또는 AA 중에 선택할 수 있다. Defaults to 'SNV'.
+            n_perm (int, optional): Number of resampled null scores. Defaults to 10000.
+            n_neighbors (int, optional): Number of position-matched synonymous variants used for null. Defaults to 50.
+            fdr_cutoff (float, optional): FDR cut-off for Resistant. Defaults to 0.05.
+            sensitive_pvalue (float, optional): Empirical p-value cut-off for Sensitive. Defaults to 0.05.
+            n_jobs (int, optional): Number of worker processes. Defaults to 4.
+            seed (int, optional): Random seed. Defaults to 0.
+
+        Raises:
+            ValueError: Occurs when an invalid value is entered for `var_type`.
+
+        Returns:
+            pd.DataFrame: Index SNV_var (or AA_var). Score (Adjusted_LFC or Resistance_score), 
+                          pvalue / FDR (resistant, upper tail), pvalue_low (lower tail) and Classification.
+        """
+
+        if var_type not in ['SNV', 'AA']:
+            raise ValueError('Not available variants type. Please select "SNV" or "AA".')
+
+        # Step1: nLFC matrix (variant x replicate)
+        list_df = [pd.read_csv(rep).set_index('SNV_var') for rep in replicates]
+
+        df_info = pd.concat([df[['AA_var', 'mut_type', 'var_pos']] for df in list_df])
+        df_info = df_info[~df_info.index.duplicated(keep='first')].copy()
+        nlfc    = np.full((1, len(df_info), len(list_df)), np.nan)
+
+        for r, df in enumerate(list_df):
+            nlfc[0, df_info.index.get_indexer(df.index), r] = df['normalized_LFC'].to_numpy()
+
+        # Step2: unit of test (SNV or AA) and their position
+        if var_type == 'AA':
+            aa_codes, aa_index = pd.factorize(df_info['AA_var'], sort=True)
+            is_aa = aa_codes >= 0
+
+            aa_onehot = sparse.csr_matrix((np.ones(is_aa.sum()), (np.where(is_aa)[0], aa_codes[is_aa])), shape=(len(df_info), len(aa_index)))
+            mut_type  = df_info.dropna(subset=['AA_var']).drop_duplicates('AA_var', keep='last').set_index('AA_var')['mut_type'].reindex(aa_index)
+            df_out    = pd.DataFrame({'mut_type': mut_type.to_numpy()}, index=pd.Index(aa_index, name='AA_var'))
+            nlfc      = _mean_by_aa(nlfc, aa_onehot)
+
+            pos   = pd.Series(aa_index).str.extract(r'(\d+)')[0].astype(np.int64).to_numpy()
+            group = np.zeros(len(df_out), dtype=np.int64)
+        else:
+            df_out = df_info[['AA_var', 'mut_type']].copy()
+            pos    = df_info['var_pos'].astype(np.int64).to_numpy()
+            group  = pd.factorize(df_info.index.str.replace(r'_?pos.*$', '', regex=True))[0]
+
+        nlfc = nlfc[0]
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', category=RuntimeWarning) # all-NaN variants
+            score = np.nanmean(nlfc, axis=1)
+
+        # Synonymous variants with nLFC of all replicates are used for null
+        is_null = (df_out['mut_type'] == 'Synonymous').to_numpy() & ~np.isnan(nlfc).any(axis=1)
+        neighbor, n_neighbor = _matched_synonymous(pos, group, is_null, n_neighbors)
+
+        # Step3: permutation in worker processes
+        param = {'nlfc': nlfc, 'score': score, 'neighbor': neighbor, 'n_neighbor': n_neighbor, 'block_size': 2**23}
+
+        n_chunk   = min(n_perm, n_jobs * 4)
+        list_seed = np.random.SeedSequence(seed).spawn(n_chunk)
+        list_job  = [(sd, n, param) for sd, n in zip(list_seed, np.diff(np.linspace(0, n_perm, n_chunk + 1).astype(int))) if n > 0]
+
+        with Pool(n_jobs) as pool:
+            list_result = list(tqdm(pool.imap(_permutation_chunk, list_job), total=len(list_job), 
+                                    desc='Permutation', ncols=70, ascii=' ='))
+
+        count_ge = np.sum([r[0] for r in list_result], axis=0)
+        count_le = np.sum([r[1] for r in list_result], axis=0)
+        testable = count_ge >= 0
+
+        # Step4: empirical p-value, FDR and classification
+        pvalue     = np.where(testable, (count_ge + 1) / (n_perm + 1), np.nan)
+        pvalue_low = np.where(testable, (count_le + 1) / (n_perm + 1), np.nan)
+        fdr        = np.full(len(pvalue), np.nan)
+        fdr[testable] = _bh_adjust(pvalue[testable])
+
+        df_out['Adjusted_LFC' if var_type == 'SNV' else 'Resistance_score'] = score
+        df_out['pvalue']     = pvalue
+        df_out['FDR']        = fdr
+        df_out['pvalue_low'] = pvalue_low
+        df_out['Classification'] = np.select([fdr < fdr_cutoff, pvalue > sensitive_pvalue], ['Resistant', 'Sensitive'], default='Intermediate')
+
+        return df_out
+
+
+    def calculate_panel(self, panel:dict, var_type:str='SNV', sensitive_cutoff:int=0.95, resistant_cutoff:int=0.997) -> pd.DataFrame:
+        """Drug panel (e.g. 6 TKIs)의 Adjusted LFC / Resistance score와 classification을 한 번에 계산한다.
+        모든 drug x replicate의 nLFC를 하나의 wide matrix로 만들고, synonymous quantile cut-off를 drug x replicate 별로 구한 뒤 
+        boolean mask로 Resistant/Sensitive/Intermediate를 분류한다. Drug 마다 결과는 calculate()와 같다.
+
+        Args:
+            panel (dict): {drug: [replicate_1, replicate_2, ...]}. Paths to the normalized (Filtered_*) files of each drug.
+            var_type (str, optional): SNV 또는 AA 중에 선택할 수 있다. Defaults to 'SNV'.
+            sensitive_cutoff (int, optional): Sensitive-Intermediate 구분에 사용되는 synonymous score cut-off. Defaults to 0.95.
+            resistant_cutoff (int, optional): Resistant-Intermediate 구분에 사용되는 synonymous score cut-off. Defaults to 0.997.
+
+        Raises:
+            ValueError: Occurs when an invalid value is entered for `var_type`.
+
+        Returns:
+            pd.DataFrame: Index SNV_var (or AA_var). Columns: mut_type (and AA_var for SNV), 
+                          nLFC_{n}_{drug}, Adjusted_LFC_{drug} (or Resistance_score_{drug}) and Classification_{drug}.
+        """        
+
+        if var_type not in ['SNV', 'AA']:
+            raise ValueError('Not available variants type. Please select "SNV" or "AA".')
+
+        # Step1: make wide nLFC matrix (variant x (drug, replicate))
+        list_info, dict_lfc = [], {}
+
+        for drug, list_rep in panel.items():
+            for n, rep in enumerate(list_rep):
+                df = pd.read_csv(rep).set_index('SNV_var')
+                dict_lfc[(drug, n + 1)] = df['normalized_LFC']
+                list_info.append(df[['AA_var', 'mut_type']])
+
+        df_lfc  = pd.concat(dict_lfc, axis=1)
+        df_info = pd.concat(list_info)
+        df_info = df_info[~df_info.index.duplicated(keep='first')].reindex(df_lfc.index)
+
+        if var_type == 'AA':
+            dict_mut_type = df_info.drop_duplicates('AA_var', keep='last').set_index('AA_var')['mut_type']
+            
+            df_lfc  = df_lfc.groupby(df_info['AA_var']).mean()
+            df_info = pd.DataFrame({'mut_type': dict_mut_type.reindex(df_lfc.index).to_numpy()}, index=df_lfc.index)
+
+        # Step2: synonymous quantile cut-off per drug x replicate
+        is_syn = (df_info['mut_type'] == 'Synonymous').to_numpy()
+
+        res_cut  = df_lfc[is_syn].quantile(resistant_cutoff)
+        sens_cut = df_lfc[is_syn].quantile(sensitive_cutoff)
+
+        # Step3: classification with boolean masks (all replicates of a drug over/under the cut-off)
+        is_resistant = (df_lfc > res_cut).T.groupby(level=0, sort=False).all().T
+        is_sensitive = (df_lfc < sens_cut).T.groupby(level=0, sort=False).all().T & ~is_resistant
+        score = df_lfc.T.groupby(level=0, sort=False).mean().T
+
+        label = np.where(is_resistant, 'Resistant', np.where(is_sensitive, 'Sensitive', 'Intermediate'))
+
+        # Step4: make output
+        score_name = 'Adjusted_LFC' if var_type == 'SNV' else 'Resistance_score'
+        df_out = df_info.copy()
+
+        for i, drug in enumerate(panel):
+            for n in range(len(panel[drug])): df_out[f'nLFC_{n+1}_{drug}'] = df_lfc[(drug, n + 1)]
+            
+            df_out[f'{score_name}_{drug}']   = score[drug]
+            df_out[f'Classification_{drug}'] = label[:, i]
+
+        return df_out
+
+
 class ReadPatternAnalyzer:
+    profile_cols = ['A', 'C', 'G', 'T', 'N', 'del', 'ins']
+
     def __init__(self,):
         """Classification based on mutation type:
         Divide and save files according to substitution/insertion/deletion/complex.
@@ -451,19 +1577,127 @@ class ReadPatternAnalyzer:
         pass
 
     
-    def run(self, freq_table:str, ref_info:str) -> pd.DataFrame:
+    def run(self, freq_table:str, ref_info:str, chunk_size:int=None) -> pd.DataFrame:
         """Executing a pipeline to analyze read patterns based on completed CRISPResso2 analysis files.
 
         Args:
             freq_table (str): Frequency table generated from CRISPResso2 results.
             ref_info (str): White list prepared for expected reads.
+            chunk_size (int, optional): Number of rows read at once (streaming mode). 
+                                        If given, only the read pattern tally (sum of #Reads/%Reads per mut_type and mut_class) is kept. Defaults to None.
 
         Returns:
-            pd.DataFrame: Read pattern 정보가 추가된 DataFrame
+            pd.DataFrame: Read pattern 정보가 추가된 DataFrame (streaming mode에서는 mut_type/mut_class 별 tally)
         """        
 
-        df_freq = pd.read_csv(freq_table, sep='\t')
         df_ref = pd.read_csv(ref_info)
+        cols   = ['Aligned_Sequence', 'Reference_Sequence', '#Reads', '%Reads']
+
+        if chunk_size == None:
+            return self._classify_reads(_read_freq_table(freq_table, columns=cols), df_ref)
+
+        # Streaming mode: chunk 마다 분류한 뒤 pattern 별 tally만 누적한다
+        df_tally = None
+
+        for df_freq in _iter_freq_table(freq_table, columns=cols, chunk_size=chunk_size):
+            df_chunk = self._classify_reads(df_freq, df_ref)
+            df_chunk = df_chunk.groupby(['mut_type', 'mut_class'], sort=False)[['#Reads', '%Reads']].sum()
+
+            if df_tally is None: df_tally = df_chunk
+            else: df_tally = df_tally.add(df_chunk, fill_value=0)
+
+        df_tally = df_tally.reset_index()
+        df_tally['#Reads'] = df_tally['#Reads'].astype(np.int64)
+
+        return df_tally[['#Reads', '%Reads', 'mut_type', 'mut_class']]
+
+
+    def profile(self, freq_table:str, chunk_size:int=None, save_path:str=None) -> tuple:
+        """Reference position 별로 read의 base / deletion / insertion을 #Reads로 가중해서 센 profile matrix를 만든다.
+        Substitution (ref base와 다른 base)과 indel이 특정 position에 몰려 있는지 보고 sequencing error hotspot과 unintended edit을 구분하는 데 사용한다.
+
+        Column order는 ReadPatternAnalyzer.profile_cols (A, C, G, T, N, del, ins)이다. 
+        Insertion은 event 단위로 바로 앞 reference position에 더한다 (시작 위치의 insertion은 position 0).
+
+        Args:
+            freq_table (str): Frequency table generated from CRISPResso2 results.
+            chunk_size (int, optional): Number of rows read at once (streaming mode). Defaults to None.
+            save_path (str, optional): Path of .npz file to save profile and ref_seq. Defaults to None.
+
+        Raises:
+            ValueError: Occurs when reads are aligned to different reference sequences or the table is empty.
+
+        Returns:
+            tuple: (profile, ref_seq). profile is np.ndarray (len(ref_seq) x 7, int64).
+        """
+
+        cols    = ['Aligned_Sequence', 'Reference_Sequence', '#Reads']
+        ref_seq = ''
+        counts  = np.zeros(0, dtype=np.float64)
+
+        for df_freq in _iter_freq_table(freq_table, columns=cols, chunk_size=chunk_size):
+            if len(df_freq) == 0: continue
+
+            # Step1: reference sequence (without gap). CRISPResso는 read 끝에서 reference를 자르기도 하므로 가장 긴 것을 기준으로 한다
+            list_ref = list(df_freq['Reference_Sequence'].str.replace('-', '', regex=False).unique()) + [ref_seq]
+            longest  = max(list_ref, key=len)
+
+            if not all(longest.startswith(seq) for seq in list_ref):
+                raise ValueError('Reads are aligned to different reference sequences. Please check your input frequency table.')
+
+            ref_seq = longest
+            counts  = np.pad(counts, (0, len(ref_seq) * 7 - len(counts)))
+
+            # Step2: read-weighted count of each position and channel
+            counts += self._profile_counts(df_freq, len(ref_seq))
+
+        if ref_seq == '':
+            raise ValueError('No reads in the frequency table. Please check your input frequency table.')
+
+        profile = np.rint(counts).astype(np.int64).reshape(len(ref_seq), 7)
+
+        if save_path != None: np.savez_compressed(save_path, profile=profile, ref_seq=np.array(ref_seq))
+
+        return profile, ref_seq
+
+
+    def _profile_counts(self, df_freq:pd.DataFrame, ref_len:int) -> np.ndarray:
+        """Frequency table (또는 chunk)의 position x channel count (flatten). 
+        같은 alignment 길이의 read끼리 2D uint8 array로 묶어서 np.bincount로 한 번에 더한다."""
+
+        # byte -> channel (A, C, G, T, N, del). 그 외 문자는 N으로 취급
+        channel = np.full(256, 4, dtype=np.int64)
+        for i, base in enumerate('ACGT'): channel[ord(base)], channel[ord(base.lower())] = i, i
+        channel[ord('-')] = 5
+
+        counts = np.zeros(ref_len * 7, dtype=np.float64)
+        aln    = df_freq['Aligned_Sequence'].astype(object).reset_index(drop=True)
+        ref    = df_freq['Reference_Sequence'].astype(object).reset_index(drop=True)
+        reads  = df_freq['#Reads'].to_numpy(dtype=np.float64)
+        lens   = aln.str.len().to_numpy()
+
+        for l, idx in pd.Series(lens).groupby(lens).indices.items():
+            arr_aln = np.frombuffer(''.join(aln.iloc[idx]).encode('ascii'), dtype=np.uint8).reshape(len(idx), l)
+            arr_ref = np.frombuffer(''.join(ref.iloc[idx]).encode('ascii'), dtype=np.uint8).reshape(len(idx), l)
+
+            is_gap  = arr_ref == ord('-')
+            ref_pos = np.cumsum(~is_gap, axis=1) - 1
+            weight  = np.broadcast_to(reads[idx][:, None], arr_aln.shape)
+
+            # Base / deletion at reference positions
+            flat    = ref_pos[~is_gap] * 7 + channel[arr_aln[~is_gap]]
+            counts += np.bincount(flat, weights=weight[~is_gap], minlength=ref_len * 7)
+
+            # Insertion event: gap column of reference sequence that starts a new gap
+            is_ins  = is_gap & ~np.pad(is_gap, ((0, 0), (1, 0)))[:, :-1]
+            flat    = np.maximum(ref_pos[is_ins], 0) * 7 + 6
+            counts += np.bincount(flat, weights=weight[is_ins], minlength=ref_len * 7)
+
+        return counts
+
+
+    def _classify_reads(self, df_freq:pd.DataFrame, df_ref:pd.DataFrame) -> pd.DataFrame:
+        """Frequency table (또는 그 chunk)의 read 마다 mut_type/mut_class를 분류한다."""
 
         is_ins = df_freq['Reference_Sequence'].str.contains('-')
         is_del = df_freq['Aligned_Sequence'].str.contains('-')
@@ -490,14 +1724,27 @@ class ReadPatternAnalyzer:
         return df_merge
 
 
-    def _count_mismatches(self, seq1:str, seq2:str) -> int:
-        """Compare 2 sequences and return the number of mismatches"""
+    def _count_mismatches(self, list_seq1, list_seq2) -> np.ndarray:
+        """Compare sequences pairwise and return the number of mismatches of each pair.
+        같은 길이의 sequence끼리 2D uint8 array (np.frombuffer)로 묶어서 한 번에 비교한다. 
+        길이가 다르면 짧은 쪽 길이까지만 비교한다 (zip과 동일).
+        """
+
+        seq1 = pd.Series(list_seq1, dtype=object).reset_index(drop=True)
+        seq2 = pd.Series(list_seq2, dtype=object).reset_index(drop=True)
+        cnt  = np.zeros(len(seq1), dtype=np.int64)
 
-        cnt = 0
+        if len(seq1) == 0: return cnt
+
+        len1, len2 = seq1.str.len().to_numpy(), seq2.str.len().to_numpy()
+
+        for (l1, l2), idx in pd.DataFrame({'l1': len1, 'l2': len2}).groupby(['l1', 'l2']).indices.items():
+            arr1 = np.frombuffer(''.join(seq1.iloc[idx]).encode('ascii'), dtype=np.uint8).reshape(len(idx), l1)
+            arr2 = np.frombuffer(''.join(seq2.iloc[idx]).encode('ascii'), dtype=np.uint8).reshape(len(idx), l2)
+            l    = min(l1, l2)
+
+            cnt[idx] = (arr1[:, :l] != arr2[:, :l]).sum(axis=1)
 
-        for a, b in zip(list(seq1), list(seq2)):
-            if a != b: cnt += 1
-        
         return cnt
 
 
@@ -513,42 +1760,27 @@ class ReadPatternAnalyzer:
             _type_: _description_
         """        
 
-        # Step1: make dictionary for read count
-        dict_ref = {}
-
-        for idx in df_ref.index:
-            dict_ref[df_ref.iloc[idx].RefSeq] = df_ref.iloc[idx].Label
+        # Step1: make key index for reference sequences (RefSeq -> 64-bit key)
+        ref_index = _SeqKeyIndex(df_ref['RefSeq'])
+        ref_label = df_ref.groupby(ref_index.codes)['Label'].last().to_numpy(dtype=object)
+        ref_pos   = ref_index.lookup(df_reads['Aligned_Sequence'])
 
         # Step2: classify substitution types
-        list_sub_type = []
-        list_sub_class= []
+        # Whitelist에 있는 read는 label, SynPrime으로 생길 수 없는 product는 mismatch 수로 분류
+        is_ref   = ref_pos >= 0
+        sub_type = np.empty(len(df_reads), dtype=object)
+        sub_type[is_ref] = ref_label[ref_pos[is_ref]]
 
-        for idx in tqdm(df_reads.index, total=len(df_reads.index), 
-                        desc='Classify pattern', ncols=100, leave=False):
-
-            data = df_reads.loc[idx]
-
-            try: 
-                mut_type = dict_ref[data.Aligned_Sequence]
-                list_sub_type.append(mut_type)
-
-                if mut_type in ['Intended_only', 'Synony_only']: 
-                    list_sub_class.append('Single_edit')
-                else:
-                    list_sub_class.append(dict_ref[data.Aligned_Sequence])
-            
-            # SynPrime으로 생길 수 없는 product에 대해서 분류
-            except:
-                cnt = self._count_mismatches(data.Aligned_Sequence, data.Reference_Sequence)
-                list_sub_type.append(f'sub{cnt}')
-                
-                if cnt > 4: list_sub_class.append(f'sub5more')
-                else      : list_sub_class.append(f'sub{cnt}')
+        cnt = self._count_mismatches(df_reads['Aligned_Sequence'][~is_ref], df_reads['Reference_Sequence'][~is_ref])
+        sub_type[~is_ref] = np.char.add('sub', cnt.astype(str)).astype(object)
 
+        sub_class = sub_type.copy()
+        sub_class[is_ref & np.isin(sub_type, ['Intended_only', 'Synony_only'])] = 'Single_edit'
+        sub_class[~is_ref] = np.where(cnt > 4, 'sub5more', sub_type[~is_ref])
 
         df_reads_type = df_reads.copy()
-        df_reads_type['mut_type'] = list_sub_type
-        df_reads_type['mut_class'] = list_sub_class
+        df_reads_type['mut_type'] = sub_type
+        df_reads_type['mut_class'] = sub_class
 
         return df_reads_type
         
@@ -617,27 +1849,31 @@ class ReadPatternAnalyzer:
         return df_out
 
 
-def single_clone_var_freq(sample_id:str, freq_table:str, wt_seq:str, edit_seq:str, intended_only:str) -> pd.DataFrame:
+def single_clone_var_freq(sample_id:str, freq_table:str, wt_seq:str, edit_seq:str, intended_only:str, chunk_size:int=None) -> pd.DataFrame:
     
     wt_seq   = wt_seq.upper()
     edit_seq = edit_seq.upper()
     
     # Step1: read CRISPResso aligned & reference file
-    df = pd.read_csv(freq_table, sep = '\t')
+    df = _iter_freq_table(freq_table, columns=['Aligned_Sequence', '#Reads'], chunk_size=chunk_size)
     
     sample_name = os.path.basename(freq_table).replace('.txt', '')
-    dict_out = {wt_seq: 0, edit_seq: 0, intended_only:0, 'Others': 0}
+    list_target = [wt_seq, edit_seq, intended_only]
 
     print(f'[Info] Start - {sample_name}')
 
-    # Step2: read count
-    for i in df.index:
-        data = df.iloc[i]
-        seq  = data['Aligned_Sequence']
-        cnt  = int(data['#Reads'])
-        
-        try   : dict_out[seq] += cnt
-        except: dict_out['Others'] += cnt
+    # Step2: read count (join Aligned_Sequence with target sequences by 64-bit key)
+    target_index = _SeqKeyIndex(list_target)
+    target_cnt, others_cnt = np.zeros(len(list_target), dtype=np.int64), 0
+
+    for df_chunk in df:
+        chunk_cnt, chunk_others = target_index.aggregate(df_chunk['Aligned_Sequence'], df_chunk['#Reads'])
+
+        target_cnt += chunk_cnt
+        others_cnt += chunk_others
+
+    dict_out = dict(zip(list_target, [int(cnt) for cnt in target_cnt]))
+    dict_out['Others'] = others_cnt
 
     dict_out['WT'] = dict_out.pop(wt_seq)
     dict_out['Variant'] = dict_out.pop(edit_seq)
@@ -31,7 +31,7 @@ class ABL1VUS:
         
         self.command = f'CRISPResso {data} {align} {output} {fixed}'
 
-    def run(self, out_dir:str, remove_temp=True):
+    def run(self, out_dir:str, remove_temp=True, to_parquet:bool=False):
 
         save_dir  = f'-o {out_dir}'
 
@@ -44,6 +44,11 @@ class ABL1VUS:
 
         shutil.copyfile(file_from, file_to) 
 
+        # Columnar cache of frequency table for VarCalling readers (requires pyarrow)
+        if to_parquet == True:
+            from src.VarCalling import convert_freq_table
+            convert_freq_table(file_to)
+
         if remove_temp == True:
             self._remove_temp_files(out_dir)
 
@@ -1,16 +1,193 @@
 import sys, os
 import pandas as pd
+import numpy as np
 
 from tqdm import tqdm
 from glob import glob
 from scipy.stats import fisher_exact
 
-def make_count_file(freq_table:str, var_ref:str) -> pd.DataFrame:
+def convert_freq_table(freq_table:str, save_path:str=None) -> str:
+    """CRISPResso frequency table (.txt)을 Parquet 파일로 변환한다. 
+    Aligned_Sequence/Reference_Sequence는 dictionary encoding (category), n_deleted 등 integer column은 작은 dtype으로 저장한다.
+    같은 이름의 .parquet 파일이 있으면 VarCalling의 reader들이 .txt 대신 자동으로 사용한다.
+
+    Args:
+        freq_table (str): Path to the frequency table file generated by CRISPResso.
+        save_path (str, optional): Path of Parquet file. Defaults to freq_table with .parquet extension.
+
+    Returns:
+        str: Path of Parquet file.
+    """    
+
+    if save_path == None: save_path = os.path.splitext(freq_table)[0] + '.parquet'
+
+    df = pd.read_csv(freq_table, sep='\t')
+
+    for col in ['Aligned_Sequence', 'Reference_Sequence']:
+        if col in df.columns: df[col] = df[col].astype('category')
+
+    for col in ['n_deleted', 'n_inserted', 'n_mutated', '#Reads']:
+        if col in df.columns: df[col] = pd.to_numeric(df[col], downcast='unsigned')
+
+    df.to_parquet(save_path, index=False)
+
+    return save_path
+
+
+def _freq_table_parquet(freq_table:str) -> str:
+    '''convert_freq_table로 만든 .parquet 파일이 있고 .txt 보다 최신이면 그 경로를, 아니면 None을 return 한다.'''
+
+    parquet = os.path.splitext(freq_table)[0] + '.parquet'
+
+    if os.path.isfile(parquet) and (not os.path.isfile(freq_table) or os.path.getmtime(parquet) >= os.path.getmtime(freq_table)):
+        return parquet
+
+    return None
+
+
+def _restore_dtypes(df:pd.DataFrame) -> pd.DataFrame:
+    '''Parquet에서 읽은 category/unsigned integer column을 .txt에서 읽은 것과 같은 dtype으로 되돌린다.'''
+
+    for col in df.columns:
+        if   isinstance(df[col].dtype, pd.CategoricalDtype): df[col] = np.asarray(df[col], dtype=object)
+        elif pd.api.types.is_unsigned_integer_dtype(df[col]): df[col] = df[col].astype(np.int64)
+
+    return df
+
+
+def _read_freq_table(freq_table:str, columns:list=None) -> pd.DataFrame:
+    """Frequency table을 읽는다. convert_freq_table로 만든 .parquet 파일이 있고 .txt 보다 최신이면
+    필요한 columns만 Parquet에서 읽고, 아니면 .txt를 읽는다. 어느 쪽이든 같은 dtype의 DataFrame을 return 한다."""
+
+    parquet = _freq_table_parquet(freq_table)
+
+    if parquet != None: return _restore_dtypes(pd.read_parquet(parquet, columns=columns))
+
+    return pd.read_csv(freq_table, sep='\t', usecols=columns)
+
+
+def _iter_freq_table(freq_table:str, columns:list=None, chunk_size:int=None):
+    """Frequency table을 chunk_size row씩 나눠서 yield 한다 (streaming mode). 
+    chunk_size가 None이면 table 전체를 한 번에 yield 한다. Peak memory는 table 크기가 아니라 chunk_size에 비례한다."""
+
+    if chunk_size == None:
+        yield _read_freq_table(freq_table, columns)
+        return
+
+    parquet = _freq_table_parquet(freq_table)
+
+    if parquet != None:
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(parquet).iter_batches(batch_size=chunk_size, columns=columns):
+            yield _restore_dtypes(batch.to_pandas())
+
+    else:
+        with pd.read_csv(freq_table, sep='\t', usecols=columns, chunksize=chunk_size) as reader:
+            for df in reader: yield df
+
+
+def _seq_key(list_seq) -> np.ndarray:
+    """Sequence를 64-bit fingerprint (uint64)로 변환한다. 같은 sequence는 한 번만 hashing 하고,
+    서로 다른 sequence가 같은 key를 가지면 (hash collision) ValueError를 낸다."""
+
+    codes, uniq = pd.factorize(np.asarray(list_seq, dtype=object))
+    uniq_key    = pd.util.hash_array(np.asarray(uniq, dtype=object), categorize=False)
+
+    if len(np.unique(uniq_key)) != len(uniq_key):
+        raise ValueError('Sequence key collision: different sequences have the same 64-bit key. Please check your input.')
+
+    return uniq_key[codes]
+
+
+class _SeqKeyIndex:
+    def __init__(self, list_seq):
+        """Reference sequence들의 64-bit key index. 
+        Read sequence를 lookup 하면 string 대신 integer key로 join 해서 reference의 위치를 return 한다.
+
+        Args:
+            list_seq (list-like): Reference sequences (e.g. RefSeq column). 중복된 sequence는 하나의 key로 묶인다.
+        """
+
+        seqs = np.asarray(list_seq, dtype=object)
+        keys = _seq_key(seqs)
+
+        self.uniq_key, first, self.codes = np.unique(keys, return_index=True, return_inverse=True)
+        self.uniq_seq = seqs[first]
+        self.n_key    = len(self.uniq_key)
+
+    def lookup(self, list_seq) -> np.ndarray:
+        """Sequence마다 matching 되는 unique key의 위치 (self.uniq_key 기준)를 return 한다. 없으면 -1.
+        Key가 같은데 sequence가 다르면 (hash collision) ValueError를 낸다."""
+
+        seqs = np.asarray(list_seq, dtype=object)
+        keys = _seq_key(seqs)
+
+        if self.n_key == 0: return np.full(len(keys), -1, dtype=np.int64)
+
+        pos = np.searchsorted(self.uniq_key, keys)
+        pos[pos == self.n_key] = 0
+
+        is_matched = self.uniq_key[pos] == keys
+        pos[~is_matched] = -1
+
+        if (self.uniq_seq[pos[is_matched]] != seqs[is_matched]).any():
+            raise ValueError('Sequence key collision: different sequences have the same 64-bit key. Please check your input.')
+
+        return pos
+
+    def aggregate(self, list_seq, weights) -> tuple:
+        """Sequence별 weights (e.g. #Reads)를 reference key 단위로 합친다.
+
+        Returns:
+            tuple: (reference 순서대로 합친 값, reference에 없는 sequence들의 합)
+        """
+
+        pos     = self.lookup(list_seq)
+        weights = np.asarray(weights, dtype=np.int64)
+
+        is_matched = pos >= 0
+        uniq_sum   = np.bincount(pos[is_matched], weights=weights[is_matched], minlength=self.n_key).astype(np.int64)
+
+        return uniq_sum[self.codes], int(weights[~is_matched].sum())
+
+
+def _count_variant_reads(df_freq:pd.DataFrame, list_refseq:pd.Series, ref_index:'_SeqKeyIndex'=None) -> np.ndarray:
+    """Frequency table의 #Reads를 RefSeq에 integer key (_SeqKeyIndex)로 join 해서, RefSeq 순서대로 read 수를 return 한다.
+    RefSeq에 없는 Aligned_Sequence의 read 수는 모두 'No_matched' RefSeq에 더한다.
+    ref_index를 주면 (같은 variant library의 여러 table을 셀 때) index를 다시 만들지 않는다.
+    df_freq는 DataFrame 또는 DataFrame chunk들의 iterator (_iter_freq_table)."""
+
+    if ref_index == None: ref_index = _SeqKeyIndex(list_refseq)
+
+    # Streaming mode: chunk 마다 RefSeq 단위로 합친 read 수만 누적한다
+    if isinstance(df_freq, pd.DataFrame): df_freq = [df_freq]
+
+    count, unmatched_cnt = np.zeros(len(list_refseq), dtype=np.int64), 0
+
+    for df in df_freq:
+        chunk_count, chunk_unmatched = ref_index.aggregate(df['Aligned_Sequence'], df['#Reads'])
+
+        count         += chunk_count
+        unmatched_cnt += chunk_unmatched
+
+    is_no_matched = (list_refseq == 'No_matched').to_numpy()
+
+    if unmatched_cnt > 0 and not is_no_matched.any():
+        raise KeyError('No_matched: Not found No_matched row in var_ref. Please check your input.')
+
+    count[is_no_matched] += unmatched_cnt
+
+    return count
+
+
+def make_count_file(freq_table:str, var_ref:str, chunk_size:int=None) -> pd.DataFrame:
     """CRISPResso2를 이용해서 각 variants마다의 read를 alignment 한 파일에서 read count를 가져온다. 
     
     Args:
         freq_table (str): CRISPResso로 생성된 frequency table 파일의 경로
         var_ref (str): 분석하고자 하는 variant가 포함된 서열과 해당 variants의 정보가 담긴 reference file의 경로
+        chunk_size (int, optional): 한 번에 읽을 row 수 (streaming mode). Memory보다 큰 table에 사용. Defaults to None (table 전체).
 
     Returns:
         pd.DataFrame: _description_
@@ -18,34 +195,17 @@ def make_count_file(freq_table:str, var_ref:str) -> pd.DataFrame:
     
     # Step1: read CRISPResso aligned & reference file
     df_ref = pd.read_csv(var_ref)
-    df = pd.read_csv(freq_table, sep = '\t')
+    df = _iter_freq_table(freq_table, columns=['Aligned_Sequence', '#Reads'], chunk_size=chunk_size)
     
     sample_name = os.path.basename(freq_table).replace('.txt', '')
-    dict_out = {}
-
-    for ref_seq in df_ref['RefSeq']:
-        dict_out[ref_seq]  = 0
 
     print(f'\n[Info] Start - {sample_name}')
-    print('[Info] Length of variants:', len(dict_out))
-
-    # Step2: read count
-    for i in tqdm(df.index, desc=f'[Info] Read counting: {sample_name}'):
-        data = df.iloc[i]
-        seq  = data['Aligned_Sequence']
-        cnt  = int(data['#Reads'])
-        
-        try   : dict_out[seq] += cnt
-        except: dict_out['No_matched'] += cnt
+    print('[Info] Length of variants:', df_ref['RefSeq'].nunique())
 
+    # Step2: read count (Aligned_Sequence 별로 합친 뒤 RefSeq과 join)
     # Step3: make output
-    list_count = []
-
-    for ref_seq in df_ref['RefSeq']:
-        list_count.append(dict_out[ref_seq])
-
     df_out = df_ref.copy()
-    df_out['count'] = list_count
+    df_out['count'] = _count_variant_reads(df, df_ref['RefSeq'])
 
     return df_out
 
@@ -64,72 +224,52 @@ def read_statistics(var_sample:str, background:str) -> pd.DataFrame:
         pd.DataFrame: _description_
     """    
 
+    # Load DataFrame
+    df_sample = pd.read_csv(var_sample)
+    df_UE     = pd.read_csv(background)
+
     ## Check var_sample과 backgound의 variants list가 완전히 동일한지 확인!
     if False in list(df_UE['RefSeq'] == df_sample['RefSeq']):
         raise ValueError('Not matched between sample and background. Please check your input files.')
 
-    # Step1: Unedit dictionary 만들기
-
-    df_UE = pd.read_csv(background)
-    
+    # Step1: Unedit key index 만들기 (RefSeq -> 64-bit key)
     UE_WT_read  = df_UE[df_UE['Label']=='WT_refseq']['count'].iloc[0]
     UE_SynPE_df = df_UE[df_UE['Label']=='SynPE'].reset_index(drop=True)
 
-    UE_SynPE_dict = {}
-
-    for i in UE_SynPE_df.index:
-        UE_data = UE_SynPE_df.iloc[i]
-        UE_SynPE_dict[UE_data['RefSeq']] = int(UE_data['count'])
+    UE_SynPE_index = _SeqKeyIndex(UE_SynPE_df['RefSeq'])
+    UE_SynPE_count = UE_SynPE_df.groupby(UE_SynPE_index.codes)['count'].last().to_numpy(dtype=np.int64)
 
     # Step2: 각 Stat file마다 odds / p-value column 추가하기
 
     f_name = os.path.basename(var_sample).replace('.csv', '')
     print('Analysis:', f_name)
     
-    df_sample = pd.read_csv(var_sample)
     df_synpe  = df_sample[df_sample['Label']=='SynPE'].reset_index(drop=True).copy()
 
     total_cnt_wtseq = df_sample[df_sample['Label']=='WT_refseq']['count'].iloc[0]
     total_cnt_edseq = df_synpe['count'].sum()
 
-    list_sample_WT  = [] # list_sample_wt_cnt
-    list_sample_RPM = []
-    list_UE_SynPE   = []
-    list_UE_WT_read = []
-    list_odds_ratio = []
-    list_pvalue     = []
-
-    for i in df_synpe.index:
-
-        data = df_synpe.loc[i]
-
-        sample_SynPE_cnt = int(df_synpe.loc[i]['count'])
-        sample_SynPE_rpm = sample_SynPE_cnt*1000000/total_cnt_edseq
-        unedit_SynPE_cnt = UE_SynPE_dict[data['RefSeq']]
-
-        # Odds ratio 계산
-        odds = ((sample_SynPE_cnt+1)/(total_cnt_wtseq+1))/((unedit_SynPE_cnt+1)/(UE_WT_read+1))
-        
-        # Fisher test p-value 계산
-        fisher_df = pd.DataFrame({'intended_edit':[sample_SynPE_cnt, unedit_SynPE_cnt], 'WT':[total_cnt_wtseq, UE_WT_read]})
-        oddsr, p = fisher_exact(table = fisher_df.to_numpy(), alternative = 'two-sided')
-
-        # 각각 계산한 값들을 list에 담기
-        list_sample_WT.append(total_cnt_wtseq)
-        list_sample_RPM.append(sample_SynPE_rpm)
-        list_UE_SynPE.append(unedit_SynPE_cnt)
-        list_UE_WT_read.append(UE_WT_read)
-        list_odds_ratio.append(odds)
-        list_pvalue.append(p)
-
-    df_synpe['Edited_WT_count'] = list_sample_WT
-    df_synpe['RPM']             = list_sample_RPM
-    df_synpe['UE_SynPE_count']  = list_UE_SynPE
-    df_synpe['UE_WT_count']     = list_UE_WT_read
-    df_synpe['OR']              = list_odds_ratio
-    df_synpe['pvalue']          = list_pvalue
+    UE_SynPE_pos = UE_SynPE_index.lookup(df_synpe['RefSeq'])
 
-    return df_synpe
+    if (UE_SynPE_pos < 0).any():
+        raise KeyError('Not found in background: %s. Please check your input files.' % df_synpe['RefSeq'][UE_SynPE_pos < 0].iloc[0])
+
+    sample_SynPE_cnt = df_synpe['count'].to_numpy(dtype=np.int64)
+    sample_SynPE_rpm = sample_SynPE_cnt*1000000/total_cnt_edseq
+    unedit_SynPE_cnt = UE_SynPE_count[UE_SynPE_pos]
 
+    # Odds ratio 계산
+    odds = ((sample_SynPE_cnt+1)/(total_cnt_wtseq+1))/((unedit_SynPE_cnt+1)/(UE_WT_read+1))
 
+    # Fisher test p-value 계산
+    list_pvalue = [fisher_exact(table=[[s_cnt, total_cnt_wtseq], [u_cnt, UE_WT_read]], alternative='two-sided')[1]
+                   for s_cnt, u_cnt in zip(sample_SynPE_cnt, unedit_SynPE_cnt)]
 
+    df_synpe['Edited_WT_count'] = total_cnt_wtseq
+    df_synpe['RPM']             = sample_SynPE_rpm
+    df_synpe['UE_SynPE_count']  = unedit_SynPE_cnt
+    df_synpe['UE_WT_count']     = UE_WT_read
+    df_synpe['OR']              = odds
+    df_synpe['pvalue']          = list_pvalue
+
+    return df_synpe